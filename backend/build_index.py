@@ -8,10 +8,27 @@ Index enriched law chunks into Weaviate
 - Retrieval: Hybrid (dynamic alpha) + Reranker
 """
 
-import os, json, weaviate
+import os
+
+# ---------------- ENV SETUP (trước khi import torch/sentence_transformers) ----------------
+# Script chỉ chạy 1 model encode CPU-bound → intra-op = số core, tắt inter-op
+# EMB_WORKERS > 1: chia đều core cho các process encode (worker spawn import lại module này)
+EMB_WORKERS = int(os.getenv("EMB_WORKERS", "1"))
+NUM_THREADS = max(1, (os.cpu_count() or 1) // EMB_WORKERS)
+os.environ["OMP_NUM_THREADS"] = str(NUM_THREADS)
+os.environ["MKL_NUM_THREADS"] = str(NUM_THREADS)
+
+import torch
+torch.set_num_threads(NUM_THREADS)
+torch.set_num_interop_threads(1)
+
+import argparse, json, time, uuid, ijson, weaviate
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from weaviate.classes.config import Property, DataType, Configure, VectorDistances
-from weaviate.classes.data import DataObject
 from sentence_transformers import SentenceTransformer
+from embed_cache import EmbeddingCache
 from tqdm import tqdm
 from pathlib import Path
 
@@ -22,16 +39,81 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 
 DATA_DIR = PROJECT_ROOT / "data" / "processed"
+EMB_FILE = PROJECT_ROOT / "data" / "chunks.parquet"   # (properties, vector) sau bước encode
+EMB_CACHE_DIR = PROJECT_ROOT / "data" / "emb_cache"    # hash(enriched_text) → vector, giữ qua các lần build
 COLLECTION_NAME = "LawChunks"
+# Stamp mỗi lần build → retriever biết chunks_cache.parquet đã cũ (uuid/text có thể đổi dù số object giữ nguyên)
+INDEX_STAMP_FILE = PROJECT_ROOT / "data" / "index_stamp.json"
+# uuid5(namespace, id leaf) → build lại vẫn giữ nguyên uuid của từng chunk
+CHUNK_UUID_NS = uuid.uuid5(uuid.NAMESPACE_DNS, "legal-qa-system.LawChunks")
 
 EMB_MODEL = "Alibaba-NLP/gte-multilingual-base"
 
+# "torch" (SentenceTransformer) hoặc "onnx" (ONNX Runtime INT8, xem encoders.py)
+EMB_BACKEND = os.getenv("EMB_BACKEND", "torch")
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", PROJECT_ROOT / "onnx_gte"))
+ENCODE_BATCH = 32 if EMB_BACKEND == "onnx" else 64
+GPU_ENCODE_BATCH = 128  # GPU: batch lớn hơn để tận dụng song song
+ENCODE_CHUNK = 128      # số record mỗi lần encode
+POOL_CHUNK = 5000       # số record mỗi lần encode_multi_process (EMB_WORKERS > 1)
+
+# gRPC client-side batching: nhiều request song song, gửi nền trong lúc encode
+BATCH_SIZE = 200
+CONCURRENT_REQUESTS = 4
+
+
+# Property gửi lên Weaviate (enriched_text truyền riêng vì đã đọc sẵn để encode)
+PROP_KEYS = (
+    "law", "law_code", "chapter", "section",
+    "article_no", "article_title", "clause_no", "point", "bullet_idx",
+    "granularity", "header", "display_citation", "path_text",
+    "clause_head", "text", "source_file",
+)
+
+
+def props_of(rec: dict, enriched: str) -> dict:
+    # Bỏ field rỗng: Weaviate coi property vắng mặt là null → payload mỗi object nhỏ hơn
+    props = {k: v for k in PROP_KEYS if (v := rec.get(k)) not in ("", None)}
+    clause_no = props.get("clause_no")
+    if clause_no is not None and not isinstance(clause_no, str):
+        props["clause_no"] = str(clause_no)  # luôn TEXT
+    if enriched:
+        props["enriched_text"] = enriched  # Full context cho reranker
+    return props
+
+
+def chunk_uuid(rec: dict) -> str:
+    return str(uuid.uuid5(CHUNK_UUID_NS, rec["id"]))
+
+
+def write_index_stamp(client):
+    count = client.collections.get(COLLECTION_NAME).aggregate.over_all(total_count=True).total_count
+    stamp = {"build_id": uuid.uuid4().hex, "count": count, "built_at": time.time()}
+    INDEX_STAMP_FILE.write_text(json.dumps(stamp), encoding="utf-8")
+
+
+def wait_for_vector_index(client, timeout: float = 1800, poll: float = 2.0) -> bool:
+    """
+    Chờ HNSW build xong (ASYNC_INDEXING=true): insert chỉ append vào vector queue,
+    graph được dựng nền phía server → đợi queue về 0 trước khi báo xong.
+    Trả về True nếu index READY, False nếu hết timeout.
+    """
+    deadline = time.time() + timeout
+    while True:
+        nodes = client.cluster.nodes(collection=COLLECTION_NAME, output="verbose")
+        shards = [sh for node in nodes for sh in (node.shards or [])]
+        pending = sum(sh.vector_queue_length or 0 for sh in shards)
+        if pending == 0 and all(sh.vector_indexing_status == "READY" for sh in shards):
+            return True
+        if time.time() > deadline:
+            print(f"⚠️ HNSW indexing still running ({pending} vectors queued)")
+            return False
+        print(f"  … HNSW indexing: {pending} vectors queued")
+        time.sleep(poll)
 
-# ========================= INIT =========================
-print("🔌 Connecting to Weaviate...")
-client = weaviate.connect_to_local()
 
-try:
+# ========================= SCHEMA =========================
+def create_collection(client):
     # Xóa collection cũ (nếu có)
     if client.collections.exists(COLLECTION_NAME):
         client.collections.delete(COLLECTION_NAME)
@@ -70,71 +152,231 @@ try:
             Property(name="source_file", data_type=DataType.TEXT, skip_vectorization=True),
         ],
         # enable hybrid search với HNSW vector index
+        # (ef_construction/max_connections không đổi được sau khi tạo → giữ giá trị cuối,
+        #  chi phí dựng graph được dời khỏi insert nhờ ASYNC_INDEXING ở docker-compose)
         vector_index_config=Configure.VectorIndex.hnsw(
             distance_metric=VectorDistances.COSINE,
             ef_construction=128,
             max_connections=64,
+            # Binary quantization: vector gte đã normalize → BQ giữ recall tốt,
+            # bộ nhớ ~32× nhỏ hơn; top-200 được rescore lại bằng vector FP32
+            quantizer=Configure.VectorIndex.Quantizer.bq(rescore_limit=200),
         ),
         # BM25 auto bật trên các TEXT field ở trên
     )
 
-    collection = client.collections.get(COLLECTION_NAME)
     print(f"✅ Collection created: {COLLECTION_NAME}")
 
-    # ========================= EMBEDDING MODEL =========================
-    print("🧠 Loading embedding model:", EMB_MODEL)
-    embedder = SentenceTransformer(EMB_MODEL, device="cpu",trust_remote_code=True)
 
-    # ========================= INDEXING =========================
-    json_files = list(DATA_DIR.glob("*.json"))
-    if not json_files:
-        print("⚠️ No processed files found. Run chunker first.")
-        raise SystemExit
+# ========================= EMBEDDING =========================
+def pick_device(requested: str = "auto") -> str:
+    """auto: cuda → mps → cpu; giá trị khác (vd "cuda:1") giữ nguyên"""
+    if requested != "auto":
+        return requested
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
 
+def load_embedder(device: str = "cpu"):
+    if EMB_BACKEND == "onnx":
+        print("🧠 Loading embedding model:", EMB_MODEL, "(onnx, cpu)")
+        from encoders import OnnxEncoder
+        return OnnxEncoder(ONNX_MODEL_DIR)
+    print("🧠 Loading embedding model:", EMB_MODEL, f"(torch, {device})")
+    return SentenceTransformer(EMB_MODEL, device=device, trust_remote_code=True)
+
+
+def iter_records(json_files):
+    """Stream record từ các file JSON (ijson) → encode bắt đầu ngay, không load cả file vào RAM"""
     for file_path in json_files:
         print(f"\n📄 Indexing: {file_path.name}")
-        data = json.loads(file_path.read_text(encoding="utf-8"))
-        print(f"  → {len(data)} chunks to embed")
-
-        batch: list[DataObject] = []
-        for rec in tqdm(data, desc="Embedding & inserting", ncols=80):
-            enriched = rec.get("enriched_text", "") or ""
-            vec = embedder.encode(enriched, normalize_embeddings=True).astype("float32").tolist()
-
-            batch.append(
-                DataObject(
-                    properties={
-                        "law": rec.get("law", ""),
-                        "law_code": rec.get("law_code", ""),
-                        "chapter": rec.get("chapter", ""),
-                        "section": rec.get("section", ""),
-                        "article_no": rec.get("article_no", ""),
-                        "article_title": rec.get("article_title", ""),
-                        "clause_no": rec.get("clause_no"),
-                        "point": rec.get("point", ""),
-                        "bullet_idx": rec.get("bullet_idx"),
-                        "granularity": rec.get("granularity", ""),
-                        "header": rec.get("header", ""),
-                        "display_citation": rec.get("display_citation", ""),
-                        "path_text": rec.get("path_text", ""),
-                        "clause_head": rec.get("clause_head", ""),
-                        "text": rec.get("text", ""),
-                        "enriched_text": enriched,  # Full context cho reranker
-                        "source_file": rec.get("source_file", ""),
-                    },
-                    vector=vec,
-                )
+        with open(file_path, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
+
+
+def batched(iterable, n: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ========================= PARQUET =========================
+# Bước encode ghi (properties, vector) ra parquet → bước ingest đọc lại, không encode lại
+PROP_COLUMNS = PROP_KEYS + ("enriched_text",)
+PARQUET_SCHEMA = pa.schema(
+    [pa.field(k, pa.int64() if k == "bullet_idx" else pa.string()) for k in PROP_COLUMNS]
+    + [pa.field("uuid", pa.string()), pa.field("vector", pa.list_(pa.float32()))]
+)
+
+
+def to_arrow(props_list: list[dict], uuids: list[str], vecs: np.ndarray) -> pa.Table:
+    n, dim = vecs.shape
+    cols = [
+        pa.array([p.get(k) for p in props_list], type=PARQUET_SCHEMA.field(k).type)
+        for k in PROP_COLUMNS
+    ]
+    cols.append(pa.array(uuids, type=pa.string()))
+    offsets = pa.array(np.arange(0, (n + 1) * dim, dim, dtype=np.int32))
+    cols.append(pa.ListArray.from_arrays(offsets, pa.array(vecs.ravel())))
+    return pa.Table.from_arrays(cols, schema=PARQUET_SCHEMA)
+
+
+def iter_parquet(path: Path):
+    """yield (properties, uuid, vector) từ file parquet, đọc theo từng batch"""
+    for rb in pq.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE):
+        cols = [rb.column(k).to_pylist() for k in PROP_COLUMNS]
+        uuids = rb.column("uuid").to_pylist()
+        vecs = rb.column("vector").flatten().to_numpy().reshape(rb.num_rows, -1)
+        for i, vec in enumerate(vecs):
+            yield {k: col[i] for k, col in zip(PROP_COLUMNS, cols) if col[i] is not None}, uuids[i], vec
+
+
+# ========================= STAGES =========================
+def encode_stage(json_files, batch=None, device: str = "cpu", use_cache: bool = True):
+    """
+    JSON → vector → parquet (EMB_FILE)
+    batch != None (stage "all"): đồng thời add_object vào Weaviate trong cùng lượt
+    use_cache: chỉ encode enriched_text chưa có trong EMB_CACHE_DIR
+    """
+    embedder = load_embedder(device)
+    on_gpu = EMB_BACKEND == "torch" and device != "cpu"
+    encode_batch = GPU_ENCODE_BATCH if on_gpu else ENCODE_BATCH
+
+    # EMB_WORKERS > 1: N process CPU độc lập (bypass GIL), mỗi process encode 1 shard
+    pool = None
+    if EMB_WORKERS > 1 and EMB_BACKEND == "torch" and not on_gpu:
+        print(f"🧵 Starting {EMB_WORKERS} CPU encode workers...")
+        pool = embedder.start_multi_process_pool(["cpu"] * EMB_WORKERS)
+    step = POOL_CHUNK if pool else ENCODE_CHUNK
+
+    def encode(texts):
+        # Encode cả chunk: SentenceTransformers tự sort theo độ dài & pad tối thiểu
+        if pool:
+            return embedder.encode_multi_process(
+                texts, pool, batch_size=encode_batch, normalize_embeddings=True,
             )
+        return embedder.encode(
+            texts,
+            batch_size=encode_batch,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+
+    # memory_size=0: mỗi text chỉ gặp 1 lần/lượt build → chỉ cần tầng disk
+    cache = EmbeddingCache(EMB_CACHE_DIR, namespace=f"{EMB_MODEL}|{EMB_BACKEND}", memory_size=0) if use_cache else None
+    tmp_path = EMB_FILE.with_suffix(".parquet.tmp")
+    writer = pq.ParquetWriter(tmp_path, PARQUET_SCHEMA)
+    try:
+        progress = tqdm(desc="Embedding", unit="chunk", ncols=80)
+        for recs in batched(iter_records(json_files), step):
+            enriched_list = [rec.get("enriched_text", "") or "" for rec in recs]
+            vecs = cache.encode(enriched_list, encode) if cache else encode(enriched_list)
+            vecs = vecs.astype(np.float32, copy=False)
+            props_list = [props_of(rec, enriched) for rec, enriched in zip(recs, enriched_list)]
+            uuids = [chunk_uuid(rec) for rec in recs]
+
+            writer.write_table(to_arrow(props_list, uuids, vecs))
+            if batch is not None:
+                for props, obj_uuid, vec in zip(props_list, uuids, vecs):
+                    batch.add_object(
+                        collection=COLLECTION_NAME,
+                        properties=props,
+                        uuid=obj_uuid,
+                        vector=vec,  # ndarray float32 → gRPC gửi raw bytes
+                    )
+            progress.update(len(recs))
+        progress.close()
+    finally:
+        writer.close()
+        if cache:
+            print(f"🗃️  Embedding cache: {cache.hits} hit / {cache.misses} encoded")
+            cache.close()
+        if pool:
+            embedder.stop_multi_process_pool(pool)
+
+    tmp_path.replace(EMB_FILE)  # chỉ thay file cũ khi encode xong trọn vẹn
+    print(f"💾 Saved embeddings: {EMB_FILE}")
+
+
+def ingest_stage(batch):
+    """parquet (EMB_FILE) → Weaviate"""
+    for props, obj_uuid, vec in tqdm(iter_parquet(EMB_FILE), desc="Inserting", unit="chunk", ncols=80):
+        batch.add_object(collection=COLLECTION_NAME, properties=props, uuid=obj_uuid, vector=vec)
+
+
+# ========================= MAIN =========================
+def main():
+    parser = argparse.ArgumentParser(description="Index law chunks into Weaviate")
+    parser.add_argument(
+        "--stage", choices=["all", "encode", "ingest"], default="all",
+        help="encode: JSON → parquet; ingest: parquet → Weaviate; all: cả hai trong 1 lượt",
+    )
+    parser.add_argument(
+        "--device", default="auto",
+        help="device encode (torch backend): auto | cpu | cuda | cuda:N | mps",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="bỏ qua embedding cache, encode lại toàn bộ",
+    )
+    args = parser.parse_args()
+    device = pick_device(args.device)
+    use_cache = not args.no_cache
+
+    json_files = list(DATA_DIR.glob("*.json"))
+    if args.stage != "ingest" and not json_files:
+        print("⚠️ No processed files found. Run chunker first.")
+        raise SystemExit
+    if args.stage == "ingest" and not EMB_FILE.exists():
+        print(f"⚠️ {EMB_FILE} not found. Run with --stage encode first.")
+        raise SystemExit
+    if args.stage == "ingest" and "uuid" not in pq.read_schema(EMB_FILE).names:
+        print(f"⚠️ {EMB_FILE} has no uuid column (old format). Run with --stage encode again.")
+        raise SystemExit
+
+    if args.stage == "encode":
+        encode_stage(json_files, device=device, use_cache=use_cache)
+        return
+
+    print("🔌 Connecting to Weaviate...")
+    client = weaviate.connect_to_local(grpc_port=50051)
+
+    try:
+        create_collection(client)
+
+        # client.batch gửi nền qua gRPC (CONCURRENT_REQUESTS request song song)
+        # → network RTT của insert chạy song song với encode chunk kế tiếp
+        with client.batch.fixed_size(batch_size=BATCH_SIZE, concurrent_requests=CONCURRENT_REQUESTS) as batch:
+            if args.stage == "all":
+                encode_stage(json_files, batch=batch, device=device, use_cache=use_cache)
+            else:
+                ingest_stage(batch)
+
+        failed = client.batch.failed_objects
+        if failed:
+            print(f"❌ {len(failed)} objects failed, e.g.: {failed[0].message}")
+            raise SystemExit(1)
 
-            if len(batch) >= 64:
-                collection.data.insert_many(batch)
-                batch = []
+        print("\n🕸️  Waiting for HNSW index build...")
+        if not wait_for_vector_index(client):
+            print("❌ HNSW index not ready before timeout")
+            raise SystemExit(1)
+        # Stamp chỉ ghi khi index đã READY → frontend không nhận build dở
+        write_index_stamp(client)
 
-        if batch:
-            collection.data.insert_many(batch)
+        print("🎉 All files indexed successfully.")
+    finally:
+        client.close()
 
-        print(f"✅ Done {file_path.name}")
 
-    print("🎉 All files indexed successfully.")
-finally:
-    client.close()
+if __name__ == "__main__":
+    main()
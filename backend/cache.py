@@ -0,0 +1,148 @@
+# cache.py
+# -*- coding: utf-8 -*-
+"""
+Answer cache 2 tầng đặt trước retrieve + rerank + Gemini
+- Exact: SHA1(query đã normalize, k) → (answer, sources)
+- Semantic: cosine(query vector) ≥ 0.95 so với các query đã cache,
+  kèm kiểm tra Jaccard trên tập display_citation của candidates hybrid ≥ 0.7
+  (tránh trả answer cũ khi index đã đổi / câu hỏi gần giống nhưng khác căn cứ)
+- Hit → bỏ qua rerank + Gemini (chỉ còn 1 lần encode + hybrid search)
+- Thread-safe: 1 instance dùng chung cho mọi session Streamlit (mỗi session 1 thread)
+"""
+
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, List, Optional, Set
+
+import numpy as np
+
+SIM_THRESHOLD = 0.95      # cosine tối thiểu giữa 2 query vector
+JACCARD_THRESHOLD = 0.7   # độ trùng tối thiểu giữa 2 tập citation
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(q: str) -> str:
+    return _WS_RE.sub(" ", q.lower().strip())
+
+
+def query_key(q: str, k: int) -> str:
+    return hashlib.sha1(f"{k}|{normalize_query(q)}".encode("utf-8")).hexdigest()
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class LRUCache:
+    """LRU + TTL trên OrderedDict (key → (timestamp, value)), khóa bằng lock"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            ts, value = item
+            if time.time() - ts > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+@dataclass
+class CacheEntry:
+    answer: str
+    sources: List[str]
+    citations: Set[str]       # display_citation của candidates hybrid lúc sinh answer
+    q_vec: np.ndarray
+    k: int
+    created: float
+
+
+class AnswerCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600,
+                 sim_threshold: float = SIM_THRESHOLD, jaccard_threshold: float = JACCARD_THRESHOLD):
+        self.exact = LRUCache(maxsize, ttl)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sim_threshold = sim_threshold
+        self.jaccard_threshold = jaccard_threshold
+        # Semantic: ma trận query vector [N, dim] append-only, bỏ hàng cũ nhất khi đầy
+        self._vecs: Optional[np.ndarray] = None
+        self._entries: List[CacheEntry] = []
+        # _vecs và _entries phải luôn cùng hàng → đọc/ghi cả cặp dưới 1 lock
+        self._lock = threading.Lock()
+
+    def get_exact(self, question: str, k: int) -> Optional[CacheEntry]:
+        return self.exact.get(query_key(question, k))
+
+    def get_semantic(self, q_vec: np.ndarray, k: int, citations: Set[str]) -> Optional[CacheEntry]:
+        """Query vector (đã normalize) gần nhất; chỉ hit nếu cùng k, chưa hết hạn, và citations đủ trùng"""
+        with self._lock:
+            vecs, entries = self._vecs, self._entries
+        if vecs is None or not entries:
+            return None
+        # vecs/entries là snapshot nhất quán: put/clear chỉ thay object mới, không sửa tại chỗ
+        sims = vecs @ np.asarray(q_vec, dtype=np.float32)
+        i = int(np.argmax(sims))
+        if sims[i] < self.sim_threshold:
+            return None
+        entry = entries[i]
+        if entry.k != k or time.time() - entry.created > self.ttl:
+            return None
+        if jaccard(entry.citations, citations) < self.jaccard_threshold:
+            return None
+        return entry
+
+    def put(self, question: str, k: int, answer: str, sources: List[str],
+            citations: Set[str], q_vec: np.ndarray) -> CacheEntry:
+        vec = np.asarray(q_vec, dtype=np.float32).reshape(1, -1)
+        entry = CacheEntry(answer, list(sources), set(citations), vec[0], k, time.time())
+        self.exact.set(query_key(question, k), entry)
+
+        with self._lock:
+            vecs = vec if self._vecs is None else np.vstack([self._vecs, vec])
+            entries = self._entries + [entry]
+            if len(entries) > self.maxsize:
+                drop = len(entries) - self.maxsize
+                vecs, entries = vecs[drop:], entries[drop:]
+            self._vecs, self._entries = vecs, entries
+        return entry
+
+    def link(self, question: str, k: int, entry: CacheEntry) -> None:
+        """Semantic hit → lưu thêm exact key cho câu hỏi mới (lần sau khỏi encode)"""
+        self.exact.set(query_key(question, k), entry)
+
+    def clear(self) -> None:
+        self.exact.clear()
+        with self._lock:
+            self._vecs = None
+            self._entries = []
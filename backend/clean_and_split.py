@@ -8,9 +8,14 @@ Hierarchical Chunking (Leaf-only) + Full Contextual Leaf Enrichment
     * enriched_text: [CHAPTER] + [ARTICLE] + [CLAUSE] + [POINT] (full context) + leaf text
     * rerank_title/rerank_body: breadcrumb + head + text (cho BM25 & rerank/hiển thị)
 - KHÔNG tạo join-map, node cha chỉ xuất khi debug (no text)
+- Annotate type đầy đủ → compile được bằng mypyc (xem main())
 """
 
-import re, json, os, unicodedata
+import re, json, os, argparse, unicodedata
+import orjson
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Pattern, Tuple
 from pathlib import Path
 
 # ===================== CONFIG =====================
@@ -39,47 +44,59 @@ MAX_HEAD_CHARS = 400
 RE_CHAPTER = re.compile(r'^(Chương\s+[IVXLC]+)\.?\s*(.*)$', re.MULTILINE | re.UNICODE)
 RE_SECTION = re.compile(r'^(Mục\s+\d+)\.?\s*(.*)$', re.MULTILINE | re.UNICODE)
 RE_ARTICLE = re.compile(r'^Điều\s+(\d+)\.?\s*(.*)$', re.MULTILINE | re.UNICODE)
-RE_CLAUSE  = re.compile(r'^(\d+)\.\s+', re.MULTILINE)
-RE_POINT   = re.compile(r'^\s*([a-zA-ZđĐ])\)\s+', re.MULTILINE)
-RE_BULLET  = re.compile(r'^\s*[-•]\s+', re.MULTILINE)
+# Khoản/Điểm/Gạch: match ở đầu dòng (dòng đã normalize, không có khoảng trắng đầu/cuối)
+# (?:\s+|$): dấu đứng riêng cuối dòng ("1." / "a)" / "-") vẫn là marker, nội dung ở dòng sau
+RE_CLAUSE  = re.compile(r'(\d+)\.(?:\s+|$)')
+RE_POINT   = re.compile(r'([a-zA-ZđĐ])\)(?:\s+|$)')
+RE_BULLET  = re.compile(r'[-•](?:\s+|$)')
+
+# normalize_text: \r → \n, \f/\v → space trong 1 lần translate
+_WS_TR = str.maketrans({'\r': '\n', '\f': ' ', '\v': ' '})
+_RE_NL_WS   = re.compile(r'\s*\n\s*')     # mọi khoảng trắng quanh xuống dòng → 1 '\n'
+_RE_HWS     = re.compile(r'[ \t]+')
+_RE_ART_DOT = re.compile(r'^(Điều\s+\d+)(\s+)([^\.\n]*)$', re.MULTILINE)
+
+_RE_WORD         = re.compile(r'\S+')
+_RE_WS           = re.compile(r'\s+')
 
 # ===================== UTILS =====================
 def normalize_text(s: str) -> str:
-    s = s.replace("\r\n","\n").replace("\r","\n")
+    s = s.translate(_WS_TR)   # \r\n → \n\n, gộp lại ở bước dưới
     s = unicodedata.normalize("NFC", s)
-    s = re.sub(r'[ \t\f\v]+', ' ', s)
-    s = re.sub(r'\s*\n\s*', '\n', s, flags=re.MULTILINE)
-    s = re.sub(r'\n{3,}', '\n\n', s)
+    # \s*\n\s* đã gộp luôn các dòng trống → không cần thêm bước \n{3,}
+    s = _RE_NL_WS.sub('\n', s)
+    s = _RE_HWS.sub(' ', s)
     # đảm bảo "Điều X. <title>" có dấu chấm
-    s = re.sub(r'^(Điều\s+\d+)(\s+)([^\.\n]*)$', r'\1. \3', s, flags=re.MULTILINE)
+    s = _RE_ART_DOT.sub(r'\1. \3', s)
     return s.strip()
 
 def token_count(text: str) -> int:
-    return len(re.findall(r'\S+', text or ""))
+    return len(_RE_WORD.findall(text or ""))
 
-def sliding_windows_by_tokens(text: str, win_tokens=WIN_TOK, overlap_tokens=OVERLAP_TOK):
-    toks = re.findall(r'\S+|\s+', text)
-    words = [i for i, t in enumerate(toks) if not t.isspace()]
-    if not words:
+def sliding_windows_by_tokens(text: str, win_tokens: int = WIN_TOK,
+                              overlap_tokens: int = OVERLAP_TOK) -> List[str]:
+    # chỉ lưu (start, end) của từng từ, window = slice thẳng trên text gốc
+    spans = [m.span() for m in _RE_WORD.finditer(text or "")]
+    if not spans:
         return [text.strip()] if (text or "").strip() else []
     out, i = [], 0
     step = max(1, win_tokens - overlap_tokens)
-    while i < len(words):
-        j = min(i + win_tokens, len(words))
-        start_tok_idx = words[i]
-        end_tok_idx   = words[j-1] + 1
-        chunk = "".join(toks[start_tok_idx:end_tok_idx]).strip()
+    while i < len(spans):
+        j = min(i + win_tokens, len(spans))
+        chunk = text[spans[i][0]:spans[j-1][1]]
         if chunk:
             out.append(chunk)
-        if j >= len(words): break
+        if j >= len(spans): break
         i += step
     return out
 
-def find_blocks(regex, text):
+Block = Tuple[int, int, Optional[re.Match[str]]]
+
+def find_blocks(regex: Pattern[str], text: str) -> List[Block]:
     ms = list(regex.finditer(text))
     if not ms:
         return [(0, len(text), None)]
-    blocks = []
+    blocks: List[Block] = []
     for i, m in enumerate(ms):
         start = m.start()
         end   = ms[i+1].start() if i+1 < len(ms) else len(text)
@@ -92,62 +109,80 @@ def find_blocks(regex, text):
 #     if m: return f"ND{m.group(1)}"
 #     return stem.upper().replace("-", "")
 
-def build_path(chapter, section, article_no, clause_no=None, point_letter=None, bullet_idx=None):
-    parts = []
+# Các leaf cùng (điều, khoản, điểm) dùng chung phần path/header/citation → cache,
+# mỗi gạch chỉ nối thêm phần "Gạch N"
+@lru_cache(maxsize=4096)
+def _path_prefix(chapter: str, section: str, article_no: str,
+                 clause_no: Optional[int], point_letter: Optional[str]) -> str:
+    parts: List[str] = []
     if chapter: parts.append(chapter)
     if section: parts.append(section)
     if article_no: parts.append(f"Điều {article_no}")
     if clause_no is not None: parts.append(f"Khoản {clause_no}")
     if point_letter: parts.append(f"Điểm {point_letter}")
-    if bullet_idx is not None: parts.append(f"Gạch {bullet_idx}")
     return " > ".join(parts)
 
-def header_of(article_no, clause_no=None, point_letter=None, bullet_idx=None):
-    parts = []
-    if bullet_idx is not None: parts.append(f"Gạch {bullet_idx}")
+def build_path(chapter: str, section: str, article_no: str, clause_no: Optional[int] = None,
+               point_letter: Optional[str] = None, bullet_idx: Optional[int] = None) -> str:
+    prefix = _path_prefix(chapter, section, article_no, clause_no, point_letter)
+    if bullet_idx is None:
+        return prefix
+    return f"{prefix} > Gạch {bullet_idx}" if prefix else f"Gạch {bullet_idx}"
+
+@lru_cache(maxsize=4096)
+def _header_tail(article_no: str, clause_no: Optional[int], point_letter: Optional[str]) -> str:
+    parts: List[str] = []
     if point_letter: parts.append(f"Điểm {point_letter}")
     if clause_no is not None: parts.append(f"Khoản {clause_no}")
     parts.append(f"Điều {article_no}")
     return " ".join(parts)
 
-def citation_of(law, article_no, clause_no=None, point_letter=None, bullet_idx=None):
-    parts = []
-    if bullet_idx is not None: parts.append(f"gạch {bullet_idx}")
+def header_of(article_no: str, clause_no: Optional[int] = None,
+              point_letter: Optional[str] = None, bullet_idx: Optional[int] = None) -> str:
+    tail = _header_tail(article_no, clause_no, point_letter)
+    return f"Gạch {bullet_idx} {tail}" if bullet_idx is not None else tail
+
+@lru_cache(maxsize=4096)
+def _citation_tail(law: str, article_no: str, clause_no: Optional[int],
+                   point_letter: Optional[str]) -> str:
+    parts: List[str] = []
     if point_letter: parts.append(f"điểm {point_letter}")
     if clause_no is not None: parts.append(f"khoản {clause_no}")
     parts.append(f"Điều {article_no} {law}")
     return " ".join(parts)
 
+def citation_of(law: str, article_no: str, clause_no: Optional[int] = None,
+                point_letter: Optional[str] = None, bullet_idx: Optional[int] = None) -> str:
+    tail = _citation_tail(law, article_no, clause_no, point_letter)
+    return f"gạch {bullet_idx} {tail}" if bullet_idx is not None else tail
+
 def truncate(s: str, max_chars: int) -> str:
-    s = re.sub(r'\s+', ' ', (s or '')).strip()
+    s = _RE_WS.sub(' ', (s or '')).strip()
     return s if len(s) <= max_chars else (s[:max_chars].rstrip() + "…")
 
-def extract_clause_head(clause_text: str, max_chars: int = MAX_HEAD_CHARS) -> str:
-    # phần đầu khoản: trước điểm a)
-    body = re.sub(r'^\d+\.\s+', '', clause_text or '', count=1).strip()
-    m = RE_POINT.search(body)
-    head = body[:m.start()].strip() if m else body
-    head = truncate(head, max_chars)
-    return head
-
 # ===== Full contextual enrichment (nội dung CHƯƠNG/ĐIỀU/KHOẢN/ĐIỂM) =====
-def enrich_text_full(chapter, article_no, article_title, clause_no, clause_head, point_letter, point_text):
-    parts = []
-    if chapter:
-        # ví dụ: "Chương II. NHỮNG QUY ĐỊNH CHUNG"
-        parts.append(f"[CHAPTER] {chapter}")
+# Tag tính 1 lần mỗi chương/điều/khoản ở process_one, emit_leaf chỉ nối chuỗi
+def chapter_tag(chapter: str) -> str:
+    # ví dụ: "[CHAPTER] Chương II. NHỮNG QUY ĐỊNH CHUNG"
+    return f"[CHAPTER] {chapter}" if chapter else ""
+
+def article_tag(article_no: str, article_title: str) -> str:
     if article_no and article_title:
-        parts.append(f"[ARTICLE] Điều {article_no}. {article_title}")
-    elif article_no:
-        parts.append(f"[ARTICLE] Điều {article_no}")
-    if clause_no is not None:
-        parts.append(f"[CLAUSE] Khoản {clause_no}. {clause_head}" if clause_head else f"[CLAUSE] Khoản {clause_no}")
-    if point_letter:
-        parts.append(f"[POINT] Điểm {point_letter}) {point_text}" if point_text else f"[POINT] Điểm {point_letter})")
-    return "\n".join(parts).strip()
+        return f"[ARTICLE] Điều {article_no}. {article_title}"
+    return f"[ARTICLE] Điều {article_no}" if article_no else ""
+
+def clause_tag(clause_no: Optional[int], clause_head: str) -> str:
+    if clause_no is None:
+        return ""
+    return f"[CLAUSE] Khoản {clause_no}. {clause_head}" if clause_head else f"[CLAUSE] Khoản {clause_no}"
+
+def point_tag(point_letter: Optional[str], point_text: Optional[str]) -> str:
+    if not point_letter:
+        return ""
+    return f"[POINT] Điểm {point_letter}) {point_text}" if point_text else f"[POINT] Điểm {point_letter})"
 
 # ===================== PARSERS =====================
-def parse_articles(doc_text):
+def parse_articles(doc_text: str) -> Iterator[Dict[str, str]]:
     # cắt từ chương đầu tiên
     m_start = RE_CHAPTER.search(doc_text)
     if m_start:
@@ -155,7 +190,7 @@ def parse_articles(doc_text):
 
     for ch_s, ch_e, ch_m in find_blocks(RE_CHAPTER, doc_text):
         ch_block = doc_text[ch_s:ch_e]
-        chapter  = (ch_m.group(1) + (". " + ch_m.group(2) if ch_m and ch_m.group(2) else "")) if ch_m else ""
+        chapter  = (f"{ch_m.group(1)}. {ch_m.group(2)}" if ch_m.group(2) else ch_m.group(1)) if ch_m else ""
         sections = find_blocks(RE_SECTION, ch_block)
 
         # không có "Mục": xử lý trực tiếp
@@ -177,7 +212,7 @@ def parse_articles(doc_text):
             # có mục
             for se_s, se_e, se_m in sections:
                 se_block = ch_block[se_s:se_e]
-                section  = (se_m.group(1) + (". " + se_m.group(2) if se_m and se_m.group(2) else "")) if se_m else ""
+                section  = (f"{se_m.group(1)}. {se_m.group(2)}" if se_m.group(2) else se_m.group(1)) if se_m else ""
                 art_ms = list(RE_ARTICLE.finditer(se_block))
                 for i, am in enumerate(art_ms):
                     a_s = am.start()
@@ -190,50 +225,143 @@ def parse_articles(doc_text):
                     yield {"chapter": chapter, "section": section, "article_no": article_no,
                            "article_title": article_title, "article_text": body}
 
-def split_clauses(article_text):
-    ms = list(RE_CLAUSE.finditer(article_text or ""))
-    if not ms:
-        return [(None, (article_text or "").strip())]
-    out = []
-    if ms[0].start() > 0:
-        pre = (article_text[:ms[0].start()] or "").strip()
-        if pre:
-            out.append((None, pre))
-    for i, m in enumerate(ms):
-        s = m.start(); e = ms[i+1].start() if i+1 < len(ms) else len(article_text)
-        out.append((int(m.group(1)), (article_text[s:e] or "").strip()))
-    return out
-
-def split_points(clause_text):
-    body = re.sub(r'^\d+\.\s+', '', clause_text or '', count=1).strip()
-    ms = list(RE_POINT.finditer(body))
-    if not ms:
-        return []
-    out = []
-    for i, m in enumerate(ms):
-        s = m.start(); e = ms[i+1].start() if i+1 < len(ms) else len(body)
-        letter = m.group(1).lower()
-        pt = (body[s:e] or "").strip()
-        pt = re.sub(r'^\s*[a-zA-ZđĐ]\)\s+', '', pt)
-        out.append((letter, pt))
-    return out
+LeafTuple = Tuple[Optional[int], str, Optional[str], Optional[int], str]
 
-def split_bullets(text):
-    ms = list(RE_BULLET.finditer(text or ""))
-    if not ms:
-        return []
-    bullets = []
-    for i, m in enumerate(ms):
-        s = m.start(); e = ms[i+1].start() if i+1 < len(ms) else len(text)
-        bt = (text[s:e] or "").strip()
-        bt = re.sub(r'^\s*[-•]\s+', '', bt)
-        bullets.append(bt)
-    return bullets
+# Helper cấp module (không dùng closure lồng nhau) → mypyc compile được
+# Điểm/gạch rỗng (marker rồi tới ngay marker kế) → text là chính marker, như split_* cũ
+def _point_leaves(clause_no: Optional[int], clause_head: str, point: str, point_mark: str,
+                  point_lines: List[str], bullets: List[List[str]],
+                  bullet_marks: List[str]) -> Iterator[LeafTuple]:
+    if bullets:
+        for bi, (b_mark, b_lines) in enumerate(zip(bullet_marks, bullets), 1):
+            yield clause_no, clause_head, point, bi, "\n".join(b_lines).strip() or b_mark
+    else:
+        yield clause_no, clause_head, point, None, "\n".join(point_lines).strip() or point_mark
+
+def _clause_leaf(clause_no: Optional[int], head_lines: List[str],
+                 clause_lines: List[str]) -> Optional[LeafTuple]:
+    # khoản không có điểm → leaf là cả khoản
+    body = "\n".join(clause_lines).strip()
+    if not body:
+        return None
+    head = truncate("\n".join(head_lines), MAX_HEAD_CHARS) if clause_no is not None else ""
+    if clause_no is not None and not head and len(clause_lines) == 1:
+        head = clause_lines[0]  # khoản chỉ có "N." → head là chính marker, như extract_clause_head cũ
+    return clause_no, head, None, None, body
+
+# Dấu đứng riêng ở dòng CUỐI của khoản/điểm/điều không phải marker (giống split_* cũ: thân đã strip
+# nên "\s+" sau dấu không còn gì để match) → nhìn trước 1 dòng để quyết định
+def _clause_at(lines: List[str], j: int) -> "Optional[re.Match[str]]":
+    m = RE_CLAUSE.match(lines[j])
+    if m and m.end() == len(lines[j]) and j + 1 >= len(lines):
+        return None
+    return m
+
+def _point_at(rest: str, lines: List[str], j: int) -> "Optional[re.Match[str]]":
+    m = RE_POINT.match(rest)
+    if m and m.end() == len(rest) and not (j + 1 < len(lines) and _clause_at(lines, j + 1) is None):
+        return None
+    return m
+
+def _bullet_at(rest: str, lines: List[str], j: int) -> "Optional[re.Match[str]]":
+    m = RE_BULLET.match(rest)
+    if m and m.end() == len(rest) and not (
+        j + 1 < len(lines) and _clause_at(lines, j + 1) is None and _point_at(lines[j + 1], lines, j + 1) is None
+    ):
+        return None
+    return m
+
+def split_leaves(article_text: str) -> Iterator[LeafTuple]:
+    """
+    1 lượt qua các dòng của điều (thay cho split_clauses → split_points → split_bullets):
+    yield (clause_no, clause_head, point_letter, bullet_idx, text) cho từng leaf
+    - Khoản có điểm → leaf là điểm (hoặc từng gạch nếu điểm có gạch)
+    - Khoản không điểm → leaf là cả khoản; phần trước khoản 1 (preamble) → leaf clause_no=None
+    """
+    clause_no: Optional[int] = None
+    clause_lines: List[str] = []   # toàn bộ dòng khoản (leaf khi không có điểm)
+    head_lines: List[str] = []     # phần đầu khoản trước điểm a) (đã bỏ "N. ")
+    clause_head = ""
+    point: Optional[str] = None
+    point_lines: List[str] = []    # nội dung điểm (đã bỏ "a) ")
+    bullets: List[List[str]] = []  # mỗi gạch: list dòng (đã bỏ "- ")
+    point_mark = ""                # "a)" như trong văn bản
+    bullet_marks: List[str] = []   # "-" / "•" của từng gạch
+    has_points = False
+    leaf: Optional[LeafTuple]
+
+    lines = (article_text or "").split("\n")
+    for j, line in enumerate(lines):
+        m = _clause_at(lines, j)
+        if m:
+            # đóng khoản trước
+            if point is not None:
+                yield from _point_leaves(clause_no, clause_head, point, point_mark, point_lines, bullets, bullet_marks)
+            if not has_points and (leaf := _clause_leaf(clause_no, head_lines, clause_lines)):
+                yield leaf
+            clause_no = int(m.group(1))
+            clause_lines, head_lines, point_lines, bullets, bullet_marks = [line], [], [], [], []
+            point, has_points = None, False
+            rest = line[m.end():]
+        else:
+            clause_lines.append(line)
+            rest = line
+
+        m = _point_at(rest, lines, j)
+        if m:
+            if point is not None:
+                yield from _point_leaves(clause_no, clause_head, point, point_mark, point_lines, bullets, bullet_marks)
+            if not has_points:
+                has_points = True
+                clause_head = truncate("\n".join(head_lines), MAX_HEAD_CHARS) if clause_no is not None else ""
+            point, point_mark = m.group(1).lower(), m.group(0).strip()
+            point_lines, bullets, bullet_marks = [], [], []
+            rest = rest[m.end():]
+        elif point is None:
+            head_lines.append(rest)
+            continue
+
+        point_lines.append(rest)
+        m = _bullet_at(rest, lines, j)
+        if m:
+            bullets.append([rest[m.end():]])
+            bullet_marks.append(m.group(0).strip())
+        elif bullets:
+            bullets[-1].append(rest)
+
+    if point is not None:
+        yield from _point_leaves(clause_no, clause_head, point, point_mark, point_lines, bullets, bullet_marks)
+    if not has_points and (leaf := _clause_leaf(clause_no, head_lines, clause_lines)):
+        yield leaf
 
 # ===================== EMIT LEAF =====================
-def emit_leaf(items, *, law, source_file, chapter, section,
-              article_no, article_title, clause_no, point_letter,
-              bullet_idx, clause_head, text):
+@dataclass(slots=True)
+class Leaf:
+    """1 record output (thứ tự field = thứ tự key trong JSON)"""
+    id: str
+    granularity: str
+    law: str
+    law_code: str
+    chapter: str
+    section: str
+    article_no: str
+    article_title: str
+    clause_no: Optional[str]
+    point: Optional[str]
+    bullet_idx: Optional[int]
+    header: str
+    display_citation: str
+    path: str
+    path_text: str          # breadcrumb cho BM25
+    clause_head: str        # đầu khoản rút gọn
+    text: str               # leaf gốc
+    enriched_text: str      # dùng cho EMBEDDING & RERANKER (full context với tags)
+    source_file: str
+
+def emit_leaf(items: List[Leaf], *, law: str, source_file: str, chapter: str, section: str,
+              article_no: str, article_title: str, clause_no: Optional[int],
+              point_letter: Optional[str], bullet_idx: Optional[int], clause_head: str,
+              text: str, ch_tag: str, art_tag: str, cla_tag: str) -> None:
     law_code = LAW_CODE_MAP[law]
     base_id = f"{Path(source_file).stem}_D{article_no}"
     if clause_no is not None:
@@ -250,35 +378,41 @@ def emit_leaf(items, *, law, source_file, chapter, section,
     # === Full contextual enrichment cho EMBEDDING & RERANKER ===
     # Nếu là bullet, point_text = None (vì text là nội dung bullet)
     # Nếu là điểm, point_text = None nếu có bullet, hoặc = text nếu là leaf cuối
-    point_text_for_enrich = None if bullet_idx is not None else (text if point_letter else None)
-    enriched = enrich_text_full(chapter, article_no, article_title, clause_no, clause_head, point_letter, point_text_for_enrich)
-    
-    # Thêm nội dung leaf vào cuối nếu chưa có
-    if text and (bullet_idx is not None or not point_letter):
-        enriched = (enriched + "\n" + text).strip()
-
-    def add_leaf_record(_id, _enriched):
-        items.append({
-            "id": _id,
-            "granularity": "leaf" if "_w" not in _id else "leaf_window",
-            "law": law,
-            "law_code": law_code,
-            "chapter": chapter,
-            "section": section,
-            "article_no": article_no,
-            "article_title": article_title,
-            "clause_no": str(clause_no) if clause_no is not None else None,
-            "point": point_letter,
-            "bullet_idx": bullet_idx,
-            "header": header,
-            "display_citation": display_citation,
-            "path": path,
-            "path_text": path,                 # breadcrumb cho BM25
-            "clause_head": clause_head,        # đầu khoản rút gọn
-            "text": (text or "").strip(),      # leaf gốc
-            "enriched_text": _enriched.strip(),# dùng cho EMBEDDING & RERANKER (full context với tags)
-            "source_file": os.path.basename(source_file)
-        })
+    # Nội dung leaf nối vào cuối nếu chưa nằm trong [POINT]
+    if bullet_idx is not None:
+        pt_tag, tail = point_tag(point_letter, None), text
+    elif point_letter:
+        pt_tag, tail = point_tag(point_letter, text), None
+    else:
+        pt_tag, tail = "", text
+    enriched = "\n".join(t for t in (ch_tag, art_tag, cla_tag, pt_tag, tail) if t).strip()
+
+    clause_no_str = str(clause_no) if clause_no is not None else None
+    leaf_text = (text or "").strip()
+    source_name = os.path.basename(source_file)
+
+    def add_leaf_record(_id: str, _enriched: str) -> None:
+        items.append(Leaf(
+            id=_id,
+            granularity="leaf" if "_w" not in _id else "leaf_window",
+            law=law,
+            law_code=law_code,
+            chapter=chapter,
+            section=section,
+            article_no=article_no,
+            article_title=article_title,
+            clause_no=clause_no_str,
+            point=point_letter,
+            bullet_idx=bullet_idx,
+            header=header,
+            display_citation=display_citation,
+            path=path,
+            path_text=path,
+            clause_head=clause_head,
+            text=leaf_text,
+            enriched_text=_enriched.strip(),
+            source_file=source_name,
+        ))
 
     # Nếu enriched quá dài, cắt window theo tokens
     if token_count(enriched) > MAX_TOKENS_LEAF:
@@ -288,82 +422,64 @@ def emit_leaf(items, *, law, source_file, chapter, section,
         add_leaf_record(base_id, enriched)
 
 # ===================== PIPELINE =====================
-def process_one(law_name: str, path: str):
+def process_one(law_name: str, path: str, pretty: bool = False) -> None:
     raw = Path(path).read_text(encoding="utf-8", errors="ignore")
     doc = normalize_text(raw)
 
-    items = []
+    items: List[Leaf] = []
 
     for art in parse_articles(doc):
-        chapter = art["chapter"]; section = art["section"]
-        article_no = art["article_no"]; article_title = art["article_title"]
-        article_text = art["article_text"]
-
-        # level 1: Khoản
-        clauses = split_clauses(article_text)
-        for clause_no, clause_body in clauses:
-            clause_head = extract_clause_head(clause_body) if clause_no is not None else ""
-
-            # level 2: Điểm
-            points = split_points(clause_body)
-            if points:
-                for letter, ptext in points:
-                    bullets = split_bullets(ptext)
-                    if bullets:
-                        for bi, bt in enumerate(bullets, 1):
-                            emit_leaf(
-                                items,
-                                law=law_name, source_file=path,
-                                chapter=chapter, section=section,
-                                article_no=article_no, article_title=article_title,
-                                clause_no=clause_no, point_letter=letter, bullet_idx=bi,
-                                clause_head=clause_head, text=bt
-                            )
-                    else:
-                        emit_leaf(
-                            items,
-                            law=law_name, source_file=path,
-                            chapter=chapter, section=section,
-                            article_no=article_no, article_title=article_title,
-                            clause_no=clause_no, point_letter=letter, bullet_idx=None,
-                            clause_head=clause_head, text=ptext
-                        )
-            else:
-                # Không có điểm -> leaf là Khoản (trừ preamble None)
-                if clause_no is not None:
-                    emit_leaf(
-                        items,
-                        law=law_name, source_file=path,
-                        chapter=chapter, section=section,
-                        article_no=article_no, article_title=article_title,
-                        clause_no=clause_no, point_letter=None, bullet_idx=None,
-                        clause_head=clause_head, text=clause_body
-                    )
-                else:
-                    preamble = (clause_body or "").strip()
-                    if preamble:
-                        emit_leaf(
-                            items,
-                            law=law_name, source_file=path,
-                            chapter=chapter, section=section,
-                            article_no=article_no, article_title=article_title,
-                            clause_no=None, point_letter=None, bullet_idx=None,
-                            clause_head="", text=preamble
-                        )
+        chapter: str = art["chapter"]; section: str = art["section"]
+        article_no: str = art["article_no"]; article_title: str = art["article_title"]
+        article_text: str = art["article_text"]
+        ch_tag = chapter_tag(chapter)
+        art_tag = article_tag(article_no, article_title)
+        cla_key: Optional[Tuple[Optional[int], str]] = None
+        cla_tag = ""
+
+        for clause_no, clause_head, letter, bullet_idx, text in split_leaves(article_text):
+            if (clause_no, clause_head) != cla_key:
+                cla_key = (clause_no, clause_head)
+                cla_tag = clause_tag(clause_no, clause_head)
+            emit_leaf(
+                items,
+                law=law_name, source_file=path,
+                chapter=chapter, section=section,
+                article_no=article_no, article_title=article_title,
+                clause_no=clause_no, point_letter=letter, bullet_idx=bullet_idx,
+                clause_head=clause_head, text=text,
+                ch_tag=ch_tag, art_tag=art_tag, cla_tag=cla_tag
+            )
 
     out_path = OUT_DIR / (Path(path).stem + ".json")
-    out_path.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding="utf-8")
+    if pretty:
+        # Debug: JSON thụt lề, dễ đọc
+        out_path.write_text(json.dumps([asdict(l) for l in items], ensure_ascii=False, indent=2), encoding="utf-8")
+    else:
+        out_path.write_bytes(orjson.dumps(items))   # UTF-8 compact, orjson serialize dataclass trực tiếp
     print(f"✓ {law_name}: {len(items)} nodes/chunks → {out_path}")
 
 # ===================== MAIN =====================
-if __name__ == "__main__":
+def main() -> None:
+    """
+    Entry point (tách khỏi __main__ để gọi được từ bản compile mypyc):
+        mypyc clean_and_split.py
+        python -c "import clean_and_split; clean_and_split.main()"
+    """
+    parser = argparse.ArgumentParser(description="Chunk văn bản luật thành leaf JSON")
+    parser.add_argument("--pretty", action="store_true", help="ghi JSON thụt lề (debug)")
+    args = parser.parse_args()
+
     print("🔄 Building contextual leaf chunks (leaf-only, full context)…")
     for name, p in INPUTS:
         try:
             if not Path(p).exists():
                 print(f"⚠️  Missing: {p}")
                 continue
-            process_one(name, p)
+            process_one(name, p, pretty=args.pretty)
         except Exception as e:
             print(f"❌ Lỗi xử lý {name} ({p}): {e}")
     print("✅ Done.")
+
+if __name__ == "__main__":
+    main()
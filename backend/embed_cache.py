@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Cache vector embedding theo nội dung text (content-hash)
+- Key: blake2b(namespace + text), 16 byte → hex; namespace = model/backend
+  → đổi model/backend không dùng nhầm vector cũ
+- Value: float32 raw bytes (np.frombuffer khi đọc)
+- 2 tầng: LRU trong RAM (query lặp lại) + diskcache (SQLite, thread/process-safe, giữ qua các lần chạy)
+- Re-index khi text không đổi: chỉ encode các text mới/đã sửa (O(changed) thay vì O(N))
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, List, Union
+
+import numpy as np
+from diskcache import Cache
+
+
+def text_key(text: str, namespace: str = "") -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(namespace.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """diskcache {hash → float32 bytes} + LRU trong RAM, dùng như context manager"""
+
+    def __init__(self, path: Union[str, Path], namespace: str = "", memory_size: int = 1024):
+        self.path = Path(path)
+        self.namespace = namespace
+        self.db = Cache(str(self.path))
+        self.memory_size = memory_size
+        self._mem: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key: str):
+        with self._lock:
+            vec = self._mem.get(key)
+            if vec is not None:
+                self._mem.move_to_end(key)
+                return vec
+        raw = self.db.get(key)
+        if raw is None:
+            return None
+        vec = np.frombuffer(raw, dtype=np.float32)
+        self._remember(key, vec)
+        return vec
+
+    def _remember(self, key: str, vec: np.ndarray):
+        if self.memory_size <= 0:
+            return
+        with self._lock:
+            self._mem[key] = vec
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.memory_size:
+                self._mem.popitem(last=False)
+
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Trả về ma trận float32 [len(texts), dim] theo đúng thứ tự texts
+        encode_fn chỉ được gọi 1 lần với các text chưa có trong cache (đã bỏ trùng)
+        """
+        keys = [text_key(t, self.namespace) for t in texts]
+        found = {}
+        todo = {}  # key → text, dict giữ thứ tự + bỏ trùng trong cùng batch
+        for k, t in zip(keys, texts):
+            if k in found or k in todo:
+                continue
+            vec = self._get(k)
+            if vec is None:
+                todo[k] = t
+            else:
+                found[k] = vec
+
+        if todo:
+            vecs = np.asarray(encode_fn(list(todo.values())), dtype=np.float32)
+            with self.db.transact():
+                for k, vec in zip(todo, vecs):
+                    self.db.set(k, vec.tobytes())
+                    found[k] = vec
+            for k in todo:
+                self._remember(k, found[k].copy())  # copy: không giữ cả ma trận batch trong RAM
+
+        self.misses += len(todo)
+        self.hits += len(texts) - len(todo)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([found[k] for k in keys])
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
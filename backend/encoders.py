@@ -0,0 +1,261 @@
+# encoders.py
+# -*- coding: utf-8 -*-
+"""
+Encoder CPU thay thế cho SentenceTransformer (gte-multilingual-base)
+- OnnxEncoder: model export ONNX + quantize INT8 dynamic, chạy qua ONNX Runtime
+- API giống SentenceTransformer.encode(...) → dùng thay trực tiếp cho `embedder`
+- Pooling: CLS token + L2 normalize (giống config pooling của gte-multilingual-base)
+- OpenVINOEncoder: cùng graph ONNX, nén weight INT8 (nncf) chạy bằng OpenVINO (VNNI/AMX trên x86)
+- OnnxReranker: bge-reranker-v2-m3 INT8, API giống CrossEncoder.predict(...)
+
+Export 1 lần (cần torch + transformers + onnxruntime; OpenVINO cần thêm openvino + nncf):
+    python -m backend.encoders onnx_gte/
+    python -m backend.encoders ov_gte/ --openvino
+    python -m backend.encoders onnx_reranker/ --reranker
+"""
+
+import os
+import argparse
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+
+EMB_MODEL = "Alibaba-NLP/gte-multilingual-base"
+RERANK_MODEL = "BAAI/bge-reranker-v2-m3"
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+OV_INT8_FILE = "model_int8.xml"
+
+
+# ===================== EXPORT =====================
+def export_onnx(out_dir: Union[str, Path], model_name: str = EMB_MODEL) -> Path:
+    """
+    Export gte-multilingual-base sang ONNX rồi quantize INT8 dynamic.
+    optimum chưa hỗ trợ kiến trúc custom "new" của gte → export thẳng bằng torch.onnx.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    # Tắt unpad/xformers để graph export được với dynamic shape
+    model = AutoModel.from_pretrained(
+        model_name,
+        trust_remote_code=True,
+        unpad_inputs=False,
+        use_memory_efficient_attention=False,
+    ).eval()
+
+    dummy = tokenizer(["Điều 1. Phạm vi điều chỉnh"], return_tensors="pt")
+    fp32_path = out / ONNX_FP32_FILE
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "last_hidden_state": {0: "batch", 1: "seq"},
+            },
+            opset_version=17,
+        )
+
+    # FP32 → INT8 (weights), activation quantize động lúc chạy
+    int8_path = out / ONNX_INT8_FILE
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(out)
+    return int8_path
+
+
+def export_openvino(out_dir: Union[str, Path], model_name: str = EMB_MODEL) -> Path:
+    """
+    Export ONNX FP32 (như export_onnx) → OpenVINO IR, nén weight INT8 bằng nncf.
+    Dùng lại graph ONNX vì optimum chưa export được kiến trúc custom của gte.
+    """
+    import nncf
+    import openvino as ov
+
+    out = Path(out_dir)
+    export_onnx(out, model_name)
+    model = ov.convert_model(str(out / ONNX_FP32_FILE))
+    model = nncf.compress_weights(model)  # mặc định INT8 weight-only
+    ov_path = out / OV_INT8_FILE
+    ov.save_model(model, str(ov_path))
+    return ov_path
+
+
+def export_reranker_onnx(out_dir: Union[str, Path], model_name: str = RERANK_MODEL) -> Path:
+    """Export CrossEncoder (XLM-R sequence classification) sang ONNX rồi quantize INT8 dynamic."""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+
+    dummy = tokenizer([["Mức phạt vượt đèn đỏ", "Điều 7. Xử phạt người điều khiển xe"]],
+                      return_tensors="pt")
+    fp32_path = out / ONNX_FP32_FILE
+    with torch.inference_mode():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "logits": {0: "batch"},
+            },
+            opset_version=17,
+        )
+
+    int8_path = out / ONNX_INT8_FILE
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(out)
+    return int8_path
+
+
+# ===================== RUNTIME =====================
+def _cpu_session(model_path: Path):
+    import onnxruntime as ort
+
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = os.cpu_count() or 1
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(str(model_path), sess_options, providers=["CPUExecutionProvider"])
+
+
+class OnnxEncoder:
+    """ONNX Runtime encoder, tương thích với SentenceTransformer.encode"""
+
+    def __init__(self, model_dir: Union[str, Path], file_name: str = ONNX_INT8_FILE,
+                 max_length: int = 8192):
+        from transformers import AutoTokenizer
+
+        model_dir = Path(model_dir)
+        self.session = _cpu_session(model_dir / file_name)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+    def _forward(self, feeds) -> np.ndarray:
+        return self.session.run(None, feeds)[0]
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               normalize_embeddings: bool = True, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Smart batching: sort theo độ dài → mỗi batch pad tối thiểu
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out = None
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            enc = self.tokenizer(
+                [texts[i] for i in idx],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feeds = {name: enc[name].astype(np.int64) for name in self.input_names}
+            hidden = self._forward(feeds)
+            emb = hidden[:, 0]  # CLS pooling
+            if out is None:
+                out = np.empty((len(texts), emb.shape[-1]), dtype=np.float32)
+            out[idx] = emb
+
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+
+class OpenVINOEncoder(OnnxEncoder):
+    """OpenVINO INT8 encoder (IR từ export_openvino), cùng tokenize/pooling/API với OnnxEncoder"""
+
+    def __init__(self, model_dir: Union[str, Path], file_name: str = OV_INT8_FILE,
+                 max_length: int = 8192):
+        import openvino as ov
+        from transformers import AutoTokenizer
+
+        model_dir = Path(model_dir)
+        # LATENCY: tối ưu cho 1 query / lần gọi
+        self.model = ov.Core().compile_model(str(model_dir / file_name), "CPU",
+                                             {"PERFORMANCE_HINT": "LATENCY"})
+        self.input_names = [i.get_any_name() for i in self.model.inputs]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+    def _forward(self, feeds) -> np.ndarray:
+        return self.model(feeds)[0]
+
+
+class OnnxReranker:
+    """ONNX Runtime cross-encoder, tương thích với CrossEncoder.predict (sigmoid score 0..1)"""
+
+    def __init__(self, model_dir: Union[str, Path], file_name: str = ONNX_INT8_FILE,
+                 max_length: int = 512):
+        from transformers import AutoTokenizer
+
+        model_dir = Path(model_dir)
+        self.session = _cpu_session(model_dir / file_name)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+    def predict(self, sentences: List[List[str]], batch_size: int = 32,
+                convert_to_numpy: bool = True, show_progress_bar: bool = False,
+                **kwargs) -> np.ndarray:
+        pairs = [list(p) for p in sentences]
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            enc = self.tokenizer(
+                [p[0] for p in batch],
+                [p[1] for p in batch],
+                padding=True,
+                truncation="only_second",
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feeds = {name: enc[name].astype(np.int64) for name in self.input_names}
+            logits = self.session.run(None, feeds)[0].reshape(-1)
+            scores[start:start + len(batch)] = logits
+        return 1.0 / (1.0 + np.exp(-scores))  # CrossEncoder num_labels=1 → sigmoid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export ONNX INT8 cho embedding / reranker")
+    parser.add_argument("out_dir", nargs="?", default=None)
+    parser.add_argument("--reranker", action="store_true", help=f"export {RERANK_MODEL}")
+    parser.add_argument("--openvino", action="store_true", help=f"export {EMB_MODEL} sang OpenVINO INT8")
+    args = parser.parse_args()
+
+    if args.reranker:
+        target = args.out_dir or "onnx_reranker"
+        print(f"📦 Exporting {RERANK_MODEL} → {target}")
+        path = export_reranker_onnx(target)
+    elif args.openvino:
+        target = args.out_dir or "ov_gte"
+        print(f"📦 Exporting {EMB_MODEL} (OpenVINO) → {target}")
+        path = export_openvino(target)
+    else:
+        target = args.out_dir or "onnx_gte"
+        print(f"📦 Exporting {EMB_MODEL} → {target}")
+        path = export_onnx(target)
+    print(f"✅ Saved: {path}")
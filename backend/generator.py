@@ -11,12 +11,14 @@ Legal Answer Generator for Vietnamese Law QA (Gemini)
 """
 
 import os
-import re
-from typing import List, Tuple
+import logging
+from typing import Iterator, List, Tuple
 
 import google.generativeai as genai
 from dotenv import load_dotenv
 
+logger = logging.getLogger("rag")
+
 
 # ===================== ENV & MODEL CONFIG =====================
 load_dotenv()
@@ -37,6 +39,13 @@ GEN_CONFIG = {
 }
 
 
+# Answer lỗi bắt đầu bằng prefix này → không được cache
+API_ERROR_PREFIX = "Lỗi khi gọi Gemini API"
+
+NO_CONTEXT_ANSWER = "Trong các trích dẫn luật được cung cấp, không có đủ thông tin để trả lời chính xác câu hỏi này."
+EMPTY_ANSWER = "Không tìm thấy đủ thông tin trong các văn bản luật đã được lập chỉ mục để trả lời câu hỏi này."
+
+
 # ===================== PROMPTS (OPTION B) =====================
 SYSTEM_INSTRUCTION = """
 Bạn là trợ lý pháp lý tiếng Việt cho lĩnh vực giao thông đường bộ.
@@ -83,17 +92,23 @@ Yêu cầu:
 """
 
 
+# Tạo model 1 lần khi import (Streamlit giữ module giữa các lần rerun)
+# → không validate config / cấp phát lại GenerativeModel mỗi request
+_MODEL = genai.GenerativeModel(
+    MODEL_NAME,
+    system_instruction=SYSTEM_INSTRUCTION,
+    generation_config=GEN_CONFIG,
+)
+
+
 # ===================== UTILS =====================
 def _dedupe_sources(sources: List[str]) -> List[str]:
-    """Loại bỏ trùng citation, giữ thứ tự xuất hiện đầu tiên."""
-    seen = set()
-    out: List[str] = []
+    """Loại bỏ trùng citation (so theo lower + gộp khoảng trắng), giữ thứ tự xuất hiện đầu tiên."""
+    first = {}
     for s in sources:
-        key = re.sub(r"\s+", " ", s.strip().lower())
-        if key and key not in seen:
-            out.append(s)
-            seen.add(key)
-    return out
+        first.setdefault(" ".join(s.lower().split()), s)
+    first.pop("", None)
+    return list(first.values())
 
 
 def _truncate_context(ctx: str, max_chars: int = 20000) -> str:
@@ -124,28 +139,23 @@ def generate_answer(question: str, context: str, sources: List[str] = None) -> T
 
     # Validate context
     if not context.strip() or len(context) < 300:
-        return "Trong các trích dẫn luật được cung cấp, không có đủ thông tin để trả lời chính xác câu hỏi này.", []
+        return NO_CONTEXT_ANSWER, []
 
     truncated_context = _truncate_context(context, max_chars=20000)
     sources = _dedupe_sources(sources or [])
 
-    # Generate answer with Gemini
-    model = genai.GenerativeModel(
-        MODEL_NAME,
-        system_instruction=SYSTEM_INSTRUCTION,
-        generation_config=GEN_CONFIG,
-    )
+    # Generate answer with Gemini (model dùng chung: _MODEL)
     prompt = _build_prompt(question, truncated_context)
 
     try:
         t0 = time.time()
-        resp = model.generate_content(prompt)
-        print(f"⏱️  Gemini API time: {time.time() - t0:.2f}s")
+        resp = _MODEL.generate_content(prompt)
+        logger.info("⏱️  Gemini API time: %.2fs", time.time() - t0)
         text = (resp.text or "").strip()
         if not text:
-            text = "Không tìm thấy đủ thông tin trong các văn bản luật đã được lập chỉ mục để trả lời câu hỏi này."
+            text = EMPTY_ANSWER
     except Exception as e:
-        text = f"Lỗi khi gọi Gemini API: {e}"
+        text = f"{API_ERROR_PREFIX}: {e}"
     # # =========================
     # # FIX format "Căn cứ pháp lý" (Đã sửa)
     # # =========================
@@ -183,3 +193,39 @@ def generate_answer(question: str, context: str, sources: List[str] = None) -> T
     #         text = re.sub(r"Căn cứ pháp lý:.*", formatted, text, flags=re.IGNORECASE | re.DOTALL)
     # Return: answer + sources
     return text, sources
+
+
+def generate_answer_stream(question: str, context: str, sources: List[str] = None) -> Tuple[Iterator[str], List[str]]:
+    """
+    Giống generate_answer nhưng trả về iterator các đoạn text (Gemini stream=True)
+    → UI hiển thị ngay token đầu tiên thay vì chờ cả câu trả lời
+    
+    Returns:
+        (answer_chunks_iterator, sources_list)
+    """
+    import time
+
+    if not context.strip() or len(context) < 300:
+        return iter([NO_CONTEXT_ANSWER]), []
+
+    truncated_context = _truncate_context(context, max_chars=20000)
+    sources = _dedupe_sources(sources or [])
+
+    prompt = _build_prompt(question, truncated_context)
+
+    def _stream() -> Iterator[str]:
+        got_text = False
+        try:
+            t0 = time.time()
+            for chunk in _MODEL.generate_content(prompt, stream=True):
+                if chunk.text:
+                    got_text = True
+                    yield chunk.text
+            logger.info("⏱️  Gemini API time (stream): %.2fs", time.time() - t0)
+        except Exception as e:
+            yield f"\n\n{API_ERROR_PREFIX}: {e}" if got_text else f"{API_ERROR_PREFIX}: {e}"
+            return
+        if not got_text:
+            yield EMPTY_ANSWER
+
+    return _stream(), sources
@@ -1,32 +1,112 @@
-from backend.retriever_custom import retrieve
-from backend.generator import generate_answer
+import os
+import time
+import logging
 
-def ask_law(question, k=5):
+from backend.retriever_custom import retrieve_candidates, retrieve, candidate_citations
+from backend.generator import generate_answer, generate_answer_stream, API_ERROR_PREFIX
+from backend.cache import AnswerCache
+
+# Dùng chung trong process (Streamlit giữ module đã import giữa các lần rerun)
+answer_cache = AnswerCache(maxsize=1024, ttl=3600)
+
+# Log timing qua logger "rag" (mặc định WARNING → INFO bị bỏ, không I/O trên hot path)
+logger = logging.getLogger("rag")
+
+def _retrieve_with_cache(question, k, metrics):
+    """
+    Cache lookup + retrieve, dùng chung cho ask_law / ask_law_stream
+    Returns: (cache_entry, None) khi hit; (None, (context, sources, citations, q_vec)) khi miss
+    """
+    metrics.update(retrieval=0.0, generation=0.0, cache=None)
+    
+    # Step 0: Exact cache (query normalize + hash)
+    hit = answer_cache.get_exact(question, k)
+    if hit:
+        logger.info("⚡ Answer cache hit (exact)")
+        metrics["cache"] = "exact"
+        return hit, None
+    
+    # Step 1: Retrieve candidates (1 lần encode dùng cho cả dense search và semantic cache)
+    logger.info("🔍 Retrieving context...")
+    t0 = time.time()
+    candidates, q_vec = retrieve_candidates(question, k=k)
+    citations = candidate_citations(candidates)
+    
+    hit = answer_cache.get_semantic(q_vec, k, citations)
+    if hit:
+        logger.info("⚡ Answer cache hit (semantic)")
+        answer_cache.link(question, k, hit)
+        metrics["retrieval"] = time.time() - t0
+        metrics["cache"] = "semantic"
+        return hit, None
+    
+    context, sources = retrieve(question, k=k, candidates=candidates)
+    metrics["retrieval"] = time.time() - t0
+    logger.info("⏱️  Retrieval time: %.2fs", metrics["retrieval"])
+    return None, (context, sources, citations, q_vec)
+
+def ask_law(question, k=5, metrics=None):
     """
     Ask a legal question and get answer with sources
     
     Args:
         question: User question
         k: Number of chunks to retrieve (default: 5)
+        metrics: dict (optional) → ghi retrieval/generation time và cache ("exact"/"semantic"/None)
     
     Returns:
         (answer_text, sources_list)
     """
-    import time
-    
-    # Step 1: Retrieve context
-    print("🔍 Retrieving context...")
-    t0 = time.time()
-    context, sources = retrieve(question, k=k)
-    print(f"⏱️  Retrieval time: {time.time() - t0:.2f}s")
+    metrics = metrics if metrics is not None else {}
+    hit, miss = _retrieve_with_cache(question, k, metrics)
+    if hit:
+        return hit.answer, hit.sources
+    context, sources, citations, q_vec = miss
     
     # Step 2: Generate answer
-    print("🤖 Generating answer...")
+    logger.info("🤖 Generating answer...")
+    t1 = time.time()
     answer, sources = generate_answer(question, context, sources)
+    metrics["generation"] = time.time() - t1
+    
+    if not answer.startswith(API_ERROR_PREFIX):
+        answer_cache.put(question, k, answer, sources, citations, q_vec)
     
     return answer, sources
 
+def ask_law_stream(question, k=5, metrics=None):
+    """
+    Giống ask_law nhưng answer là iterator các đoạn text (stream từ Gemini)
+    Retrieval chạy ngay khi gọi; generation chạy khi iterate.
+    metrics["generation"] và answer cache được cập nhật khi stream kết thúc.
+    
+    Returns:
+        (answer_chunks_iterator, sources_list)
+    """
+    metrics = metrics if metrics is not None else {}
+    hit, miss = _retrieve_with_cache(question, k, metrics)
+    if hit:
+        return iter([hit.answer]), hit.sources
+    context, sources, citations, q_vec = miss
+    
+    logger.info("🤖 Generating answer (stream)...")
+    stream, sources = generate_answer_stream(question, context, sources)
+    
+    def _run():
+        t1 = time.time()
+        parts = []
+        for piece in stream:
+            parts.append(piece)
+            yield piece
+        metrics["generation"] = time.time() - t1
+        answer = "".join(parts).strip()
+        if API_ERROR_PREFIX not in answer:
+            answer_cache.put(question, k, answer, sources, citations, q_vec)
+    
+    return _run(), sources
+
 if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
     q = """Tôi đi ô tô mà chạy sang làn đường dành cho xe máy thì bị xử phạt như thế nào?"""
     
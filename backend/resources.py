@@ -0,0 +1,335 @@
+# resources.py
+# -*- coding: utf-8 -*-
+"""
+Tài nguyên nặng dùng chung cho retriever (load 1 lần / process)
+- Embedding model, reranker, Weaviate client, chunk list + BM25 index
+- Bọc bằng st.cache_resource → giữ nguyên qua các lần rerun / hot-reload của Streamlit
+  và dùng chung giữa các session (thread) thay vì load lại model ~2 GB
+- Không có streamlit (CLI, rag_qa.py) → functools.lru_cache, hành vi giống hệt
+"""
+
+import os
+import json
+import hashlib
+import functools
+from pathlib import Path
+
+import numpy as np
+import torch
+import weaviate
+from weaviate.classes.query import Filter
+import pyarrow as pa
+import pyarrow.parquet as pq
+import bm25s
+from sentence_transformers import SentenceTransformer, CrossEncoder
+
+from backend.vi_tokenizer import tokenize_corpus
+from backend.embed_cache import EmbeddingCache
+
+try:
+    import streamlit as st
+    cache_resource = st.cache_resource
+except ImportError:
+    cache_resource = functools.lru_cache(maxsize=None)
+
+# ---------------- ENV SETUP ----------------
+os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+torch.backends.mps.is_available = lambda: False
+# CPU: dùng hết core cho forward của CrossEncoder/encoder (không khóa 1 thread)
+torch.set_num_threads(os.cpu_count() or 1)
+
+# ---------------- CONFIG ----------------
+BM25_INDEX_DIR = Path("bm25s_index")    # bm25s.save(...) + chunks_hash.txt
+# Chunk list cache: parquet + sidecar {"count", "hash", "build_id"} → khởi động không phải fetch 10k object qua mạng
+CHUNKS_CACHE_FILE = Path("chunks_cache.parquet")
+CHUNKS_META_FILE = Path("chunks_cache.json")
+# build_index.py ghi stamp sau mỗi lần build (build_id mới) → parquet cache của build cũ bị bỏ
+INDEX_STAMP_FILE = Path(__file__).resolve().parents[1] / "data" / "index_stamp.json"
+CACHE_PROBE_SIZE = 5  # số chunk (rải đều) so uuid + text với Weaviate trước khi dùng parquet cache
+# Ma trận embedding của chunks (hàng = hàng của chunks_cache) → dense search local, không qua Weaviate
+CHUNK_VECTORS_FILE = Path("chunks_vectors.npy")
+CHUNK_VECTORS_HASH_FILE = Path("chunks_vectors.hash")
+# "local": faiss.IndexFlatIP (hoặc numpy nếu chưa cài faiss) trên CHUNK_VECTORS_FILE; "weaviate": near_vector như cũ
+DENSE_BACKEND = os.getenv("DENSE_BACKEND", "local")
+
+CHUNK_PROPS = [
+    "law", "chapter", "section", "article_no", "article_title",
+    "clause_no", "point", "clause_head", "text",
+    "enriched_text", "display_citation"
+]
+CHUNK_FIELDS = CHUNK_PROPS + ["uuid"]  # uuid Weaviate → map kết quả dense về hàng của chunks_cache
+# Schema cố định cho parquet cache: from_pylist chỉ suy cột từ hàng đầu → prop rỗng ở hàng 0 sẽ mất cả cột
+CHUNKS_SCHEMA = pa.schema([(f, pa.string()) for f in CHUNK_FIELDS])
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Reranker: "torch" (CrossEncoder, FP16 trên GPU) hoặc "onnx" (INT8 CPU, xem encoders.py)
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "torch")
+ONNX_RERANKER_DIR = Path(os.getenv("ONNX_RERANKER_DIR", Path(__file__).resolve().parents[1] / "onnx_reranker"))
+RERANK_MODEL_NAME = "BAAI/bge-reranker-v2-m3"
+
+EMB_MODEL_NAME = "Alibaba-NLP/gte-multilingual-base"
+# Query encoder: "torch" (SentenceTransformer), "onnx" (ONNX Runtime INT8) hoặc "openvino" (OpenVINO INT8), xem encoders.py
+QUERY_EMB_BACKEND = os.getenv("QUERY_EMB_BACKEND", "torch")
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", Path(__file__).resolve().parents[1] / "onnx_gte"))
+OPENVINO_MODEL_DIR = Path(os.getenv("OPENVINO_MODEL_DIR", Path(__file__).resolve().parents[1] / "ov_gte"))
+# Query embedding cache (RAM + disk): câu hỏi lặp lại không phải encode lại
+QUERY_EMB_CACHE_DIR = Path(os.getenv("QUERY_EMB_CACHE_DIR", ".emb_cache"))
+
+
+# ---------------- MODELS ----------------
+@cache_resource
+def get_emb_model():
+    print(f"🔹 Loading embedding model ({QUERY_EMB_BACKEND}, {DEVICE if QUERY_EMB_BACKEND == 'torch' else 'cpu'})...")
+    if QUERY_EMB_BACKEND == "openvino":
+        from backend.encoders import OpenVINOEncoder
+        model = OpenVINOEncoder(OPENVINO_MODEL_DIR)
+    elif QUERY_EMB_BACKEND == "onnx":
+        from backend.encoders import OnnxEncoder
+        model = OnnxEncoder(ONNX_MODEL_DIR)
+    else:
+        model = SentenceTransformer(EMB_MODEL_NAME, device=DEVICE, trust_remote_code=True)
+    print("✓ Embedding model loaded")
+    return model
+
+@cache_resource
+def get_query_emb_cache():
+    return EmbeddingCache(QUERY_EMB_CACHE_DIR, namespace=f"{EMB_MODEL_NAME}|{QUERY_EMB_BACKEND}|query")
+
+@cache_resource
+def get_reranker():
+    print(f"🔹 Loading reranker model ({RERANK_BACKEND}, {DEVICE if RERANK_BACKEND == 'torch' else 'cpu'})...")
+    if RERANK_BACKEND == "onnx":
+        from backend.encoders import OnnxReranker
+        reranker = OnnxReranker(ONNX_RERANKER_DIR)
+    else:
+        reranker = CrossEncoder(RERANK_MODEL_NAME, device=DEVICE)
+        if DEVICE == "cuda":
+            reranker.model.half()  # FP16: nửa băng thông bộ nhớ, tensor core
+    print("✓ Reranker loaded")
+    return reranker
+
+@cache_resource
+def get_weaviate_client():
+    print("🌐 Connecting to Weaviate...")
+    client = weaviate.connect_to_local()
+    print("✓ Connected to Weaviate")
+    return client
+
+def get_collection():
+    return get_weaviate_client().collections.get("LawChunks")
+
+
+# ---------------- CHUNKS + BM25 INDEX ----------------
+def load_chunks_from_weaviate(collection):
+    """Load chunks từ Weaviate (fetch toàn bộ qua mạng)"""
+    resp = collection.query.fetch_objects(
+        limit=10000,
+        return_properties=CHUNK_PROPS
+    )
+
+    chunks = []
+    for obj in resp.objects:
+        # Prop rỗng không được ghi lên Weaviate → điền None để mọi chunk có đủ CHUNK_FIELDS
+        chunks.append({**{f: obj.properties.get(f) for f in CHUNK_PROPS}, "uuid": str(obj.uuid)})
+
+    return chunks
+
+def chunks_fingerprint(chunks) -> str:
+    """
+    md5 theo ĐÚNG THỨ TỰ của (uuid, text, enriched_text) → nhận biết tập chunk / nội dung / thứ tự đổi
+    (BM25 index và ma trận vector căn theo hàng của chunks_cache)
+    """
+    h = hashlib.md5()
+    for c in chunks:
+        for key in ("uuid", "text", "enriched_text"):
+            h.update((c.get(key) or "").encode("utf-8"))
+            h.update(b"\0")
+    return h.hexdigest()
+
+def read_index_stamp():
+    """build_id của lần build_index gần nhất (None nếu chưa có stamp)"""
+    if not INDEX_STAMP_FILE.exists():
+        return None
+    return json.loads(INDEX_STAMP_FILE.read_text(encoding="utf-8")).get("build_id")
+
+def probe_chunks(collection, chunks) -> bool:
+    """Lấy vài chunk rải đều trong cache, kiểm tra uuid còn trên Weaviate và text không đổi"""
+    if not chunks:
+        return False
+    step = max(1, len(chunks) // CACHE_PROBE_SIZE)
+    sample = {c["uuid"]: c for c in chunks[::step][:CACHE_PROBE_SIZE]}
+    resp = collection.query.fetch_objects(
+        filters=Filter.by_id().contains_any(list(sample)),
+        limit=len(sample),
+        return_properties=["text", "enriched_text"],
+    )
+    if len(resp.objects) != len(sample):
+        return False
+    for obj in resp.objects:
+        c = sample[str(obj.uuid)]
+        if any((obj.properties.get(k) or "") != (c.get(k) or "") for k in ("text", "enriched_text")):
+            return False
+    return True
+
+def load_chunks(collection, force_refresh: bool = False):
+    """
+    Chunk list: đọc parquet cache nếu còn khớp Weaviate (số object, build_id của build_index, probe uuid + text),
+    ngược lại fetch lại + ghi cache
+    Returns: (chunks, chunks_hash)
+    """
+    count = collection.aggregate.over_all(total_count=True).total_count
+    build_id = read_index_stamp()
+    if not force_refresh and CHUNKS_CACHE_FILE.exists() and CHUNKS_META_FILE.exists():
+        meta = json.loads(CHUNKS_META_FILE.read_text(encoding="utf-8"))
+        if (meta.get("count") == count and meta.get("fields") == CHUNK_FIELDS
+                and meta.get("build_id") == build_id):
+            table = pq.read_table(CHUNKS_CACHE_FILE)
+            chunks = table.to_pylist()
+            # cache cũ (ghi không có schema) có thể thiếu cột → coi như hết hạn
+            if table.column_names == CHUNK_FIELDS and probe_chunks(collection, chunks):
+                print("📂 Loading cached chunks (parquet)...")
+                return chunks, meta["hash"]
+        print("⚠️  Chunk cache out of date")
+
+    print("📂 Loading chunks from Weaviate...")
+    chunks = load_chunks_from_weaviate(collection)
+    chunks_hash = chunks_fingerprint(chunks)
+    pq.write_table(pa.Table.from_pylist(chunks, schema=CHUNKS_SCHEMA), CHUNKS_CACHE_FILE)
+    CHUNKS_META_FILE.write_text(json.dumps({
+        "count": len(chunks), "hash": chunks_hash, "fields": CHUNK_FIELDS, "build_id": build_id,
+    }), encoding="utf-8")
+    return chunks, chunks_hash
+
+def build_bm25_index(chunks, chunks_hash: str = ""):
+    """Build BM25 index với pyvi tokenization"""
+    print("\n🔨 Building BM25 index với pyvi...")
+
+    texts = []
+    for c in chunks:
+        # Combine fields for BM25 (giống eval code)
+        fields = [
+            c.get("article_no", ""),
+            c.get("article_title", ""),
+            c.get("clause_no", ""),
+            c.get("point", ""),
+            c.get("clause_head", ""),
+            c.get("text", ""),
+        ]
+        texts.append(" ".join([f for f in fields if f]))
+
+    # Tokenize với pyvi (song song nhiều process)
+    tokenized_corpus = tokenize_corpus(texts)
+
+    # bm25s: điểm BM25 tính sẵn thành ma trận sparse (lucene idf), dùng numba nếu có cài
+    index = bm25s.BM25(method="lucene")
+    index.index(tokenized_corpus, show_progress=False)
+
+    # Cache index BM25 (chunks cache riêng ở CHUNKS_CACHE_FILE)
+    index.save(str(BM25_INDEX_DIR))
+    (BM25_INDEX_DIR / "chunks_hash.txt").write_text(chunks_hash, encoding="utf-8")  # doc id ↔ thứ tự chunks_cache
+
+    print(f"✓ BM25 index built: {len(chunks)} chunks, vocab {len(index.vocab_dict)}")
+    return index
+
+def invalidate_chunks():
+    """
+    Bỏ chunk cache (parquet sidecar) + các resource dựng trên nó → lần get_* sau fetch lại từ Weaviate
+    (gọi khi thấy uuid trên Weaviate không còn khớp chunks_cache, vd. vừa build lại index)
+    """
+    CHUNKS_META_FILE.unlink(missing_ok=True)
+    for fn in (get_bm25_and_chunks, get_dense_index):
+        # st.cache_resource → .clear(); functools.lru_cache → .cache_clear()
+        (getattr(fn, "clear", None) or fn.cache_clear)()
+
+@cache_resource
+def get_bm25_and_chunks():
+    """
+    Chunk list (parquet cache, fetch Weaviate khi số object đổi) + BM25 index (build lại nếu tập chunk đã đổi)
+    Returns: (chunks, chunks_hash, uuid_to_row, bm25_index)
+    """
+    chunks, chunks_hash = load_chunks(get_collection())
+    uuid_to_row = {c["uuid"]: i for i, c in enumerate(chunks)}
+    print(f"✓ Loaded {len(chunks)} chunks")
+
+    bm25_index = None
+    hash_file = BM25_INDEX_DIR / "chunks_hash.txt"
+    if hash_file.exists():
+        if hash_file.read_text(encoding="utf-8") != chunks_hash:
+            print("⚠️  BM25 index out of date")
+        else:
+            print("📂 Loading cached BM25 index...")
+            bm25_index = bm25s.BM25.load(str(BM25_INDEX_DIR))
+            print(f"✓ BM25 index loaded")
+    if bm25_index is None:
+        bm25_index = build_bm25_index(chunks, chunks_hash)
+
+    return chunks, chunks_hash, uuid_to_row, bm25_index
+
+
+# ---------------- LOCAL DENSE INDEX ----------------
+class NumpyIndexFlatIP:
+    """Fallback khi chưa cài faiss: cùng API search() với faiss.IndexFlatIP (1 GEMV + argpartition)"""
+
+    def __init__(self, mat: np.ndarray):
+        self.mat = mat
+
+    def search(self, q: np.ndarray, k: int):
+        sims = q @ self.mat.T
+        k = min(k, self.mat.shape[0])
+        I = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        D = np.take_along_axis(sims, I, axis=1)
+        order = np.argsort(-D, axis=1, kind="stable")
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+def load_chunk_vectors(chunks, chunks_hash: str) -> np.ndarray:
+    """
+    Ma trận [N, dim] float32 theo thứ tự chunks, cache ở CHUNK_VECTORS_FILE (build lại khi tập chunk đổi)
+    Lấy vector đã lưu trên Weaviate; chunk nào thiếu vector → encode enriched_text
+    """
+    if CHUNK_VECTORS_FILE.exists() and CHUNK_VECTORS_HASH_FILE.exists():
+        if CHUNK_VECTORS_HASH_FILE.read_text(encoding="utf-8") == chunks_hash:
+            print("📂 Loading cached chunk vectors...")
+            return np.load(CHUNK_VECTORS_FILE)
+
+    print("📥 Fetching chunk vectors from Weaviate...")
+    uuid_to_row = {c["uuid"]: i for i, c in enumerate(chunks)}
+    vectors = [None] * len(chunks)
+    for obj in get_collection().iterator(include_vector=True, return_properties=[]):
+        row = uuid_to_row.get(str(obj.uuid))
+        vec = obj.vector.get("default") if obj.vector else None
+        if row is not None and vec:
+            vectors[row] = vec
+
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        print(f"🔹 Encoding {len(missing)} chunks without stored vector...")
+        embs = get_emb_model().encode(
+            [chunks[i].get("enriched_text", "") or "" for i in missing],
+            batch_size=64, normalize_embeddings=True, convert_to_numpy=True,
+        )
+        for i, vec in zip(missing, embs):
+            vectors[i] = vec
+
+    mat = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    np.save(CHUNK_VECTORS_FILE, mat)
+    CHUNK_VECTORS_HASH_FILE.write_text(chunks_hash, encoding="utf-8")
+    return mat
+
+@cache_resource
+def get_dense_index():
+    """faiss.IndexFlatIP trên vector đã normalize (inner product = cosine); None nếu DENSE_BACKEND=weaviate"""
+    if DENSE_BACKEND != "local":
+        return None
+    chunks, chunks_hash, _, _ = get_bm25_and_chunks()
+    mat = load_chunk_vectors(chunks, chunks_hash)
+    try:
+        import faiss
+    except ImportError:
+        print(f"✓ Dense index (numpy): {mat.shape[0]} x {mat.shape[1]}")
+        return NumpyIndexFlatIP(mat)
+    index = faiss.IndexFlatIP(mat.shape[1])
+    index.add(mat)
+    print(f"✓ Dense index (faiss): {index.ntotal} x {mat.shape[1]}")
+    return index
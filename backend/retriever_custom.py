@@ -2,40 +2,62 @@
 # -*- coding: utf-8 -*-
 """
 Custom Retriever với BM25+pyvi + Dense + Reranker
-- BM25: rank-bm25 với pyvi tokenization (tốt hơn Weaviate built-in)
+- BM25: bm25s (sparse, numba nếu có) với pyvi tokenization (tốt hơn Weaviate built-in)
 - Dense: Weaviate vector search với Alibaba-NLP/gte-multilingual-base
 - Reranker: BAAI/bge-reranker-v2-m3
 - Hybrid: alpha tuning based on query patterns
 """
 
-import os
 import re
-import json
-import pickle
+import logging
+import threading
 import numpy as np
-from pathlib import Path
-from typing import List, Dict, Tuple
-
-import torch
-import weaviate
-from pyvi import ViTokenizer
-from rank_bm25 import BM25Okapi
-from sentence_transformers import SentenceTransformer, CrossEncoder
-
-# ---------------- ENV SETUP ----------------
-os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
-torch.backends.mps.is_available = lambda: False
-torch.set_num_threads(1)
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from backend.vi_tokenizer import tokenize_query
+from backend.resources import (
+    get_emb_model, get_query_emb_cache, get_reranker, get_weaviate_client, get_collection,
+    get_bm25_and_chunks, get_dense_index, invalidate_chunks,
+)
 
 # ---------------- CONFIG ----------------
-BM25_INDEX_FILE = Path("bm25_index.pkl")
+# Model, Weaviate client, chunk list, BM25 index: xem resources.py (st.cache_resource)
+# 20-30 candidates sort theo độ dài → batch 8: mỗi batch chỉ pad tới text dài nhất của nó
+RERANK_BATCH = 8
+DENSE_PROPS = ["display_citation"]  # near_vector chỉ cần uuid + score, props lấy từ chunks_cache
+
+# BM25 (pyvi + numpy, CPU) chạy ở thread riêng, song song với encode query + Weaviate RTT
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bm25")
 
 # Reranking config: lấy nhiều candidates để rerank có hiệu quả
 CANDIDATE_MULTIPLIER = 4  # Lấy 4x số chunks cần thiết làm candidates
 
+# Early-exit: query có trích dẫn Điều/Khoản và top hybrid vượt hẳn hạng k → bỏ qua reranker
+RERANK_SKIP_GAP = 0.25
+rerank_stats = {"total": 0, "skipped": 0}  # theo dõi tỉ lệ skip để chỉnh RERANK_SKIP_GAP
+
+logger = logging.getLogger("rag")
+
+
+class ChunkIndex(NamedTuple):
+    """
+    Snapshot bất biến của chunk list + các index căn theo hàng của nó
+    refresh_chunks thay cả snapshot 1 lần → 1 request chỉ đọc 1 snapshot từ đầu tới cuối
+    """
+    chunks: List[Dict]             # chunks_cache
+    chunks_hash: str
+    uuid_to_row: Dict[str, int]
+    bm25: object                   # bm25s.BM25
+    dense: Optional[object]        # IndexFlatIP (faiss/numpy), None → dense search qua Weaviate
+
+
+class Candidates(NamedTuple):
+    """Candidates dạng SoA (không list-of-dict): sort theo hybrid score giảm dần"""
+    idx: np.ndarray    # int32, hàng trong index.chunks
+    score: np.ndarray  # float32, hybrid score
+    index: ChunkIndex  # snapshot mà idx trỏ vào (retrieve/rerank dùng lại, không đọc global)
+
 # ---------------- PATTERNS ----------------
 LEGAL_HINT_RE = re.compile(r"\b(Chương|Mục|Điều|Khoản|Điểm)\s+[IVXLC\d]+", re.IGNORECASE)
 NUMERIC_INFO_RE = re.compile(r"\b(\d+)\s*(giờ|km/h|triệu|nghìn|đồng|lần|ngày|tháng|năm|%|phần trăm|cm3|cc|tấn|km|m|kW|điểm|giấy phép lái xe)\b", re.IGNORECASE)
@@ -53,263 +75,265 @@ def tune_alpha(query: str, base_alpha: float = 0.55) -> float:
     
     return alpha
 
-# ---------------- LOAD MODELS ----------------
-print("🔹 Loading embedding model...")
-emb_model = SentenceTransformer("Alibaba-NLP/gte-multilingual-base", device="cuda", trust_remote_code=True)
-print("✓ Embedding model loaded")
-
-print("🔹 Loading reranker model...")
-reranker = CrossEncoder("BAAI/bge-reranker-v2-m3", device="cuda")
-print("✓ Reranker loaded")
-
-print("🌐 Connecting to Weaviate...")
-client = weaviate.connect_to_local()
-weaviate_collection = client.collections.get("LawChunks")
-print("✓ Connected to Weaviate")
-
-# ---------------- BUILD/LOAD BM25 INDEX ----------------
-def load_chunks_from_weaviate():
-    """Load chunks từ Weaviate (luôn fresh, không cache)"""
-    resp = weaviate_collection.query.fetch_objects(
-        limit=10000,
-        return_properties=[
-            "law", "chapter", "section", "article_no", "article_title",
-            "clause_no", "point", "clause_head", "text",
-            "enriched_text", "display_citation"
-        ]
-    )
-    
-    chunks = []
-    for obj in resp.objects:
-        chunks.append(obj.properties)
-    
-    return chunks
+# ---------------- LOAD MODELS / INDEX ----------------
+# Các getter được cache_resource → rerun / hot-reload của Streamlit không load lại
+emb_model = get_emb_model()
+query_emb_cache = get_query_emb_cache()
+reranker = get_reranker()
+client = get_weaviate_client()
+weaviate_collection = get_collection()
 
-def build_bm25_index(chunks):
-    """Build BM25 index với pyvi tokenization"""
-    print("\n🔨 Building BM25 index với pyvi...")
-    
-    tokenized_corpus = []
-    for c in chunks:
-        # Combine fields for BM25 (giống eval code)
-        fields = [
-            c.get("article_no", ""),
-            c.get("article_title", ""),
-            c.get("clause_no", ""),
-            c.get("point", ""),
-            c.get("clause_head", ""),
-            c.get("text", ""),
-        ]
-        combined = " ".join([f for f in fields if f])
-        
-        # Tokenize với pyvi
-        tokenized = ViTokenizer.tokenize(combined)
-        tokenized_corpus.append(tokenized.split())
-    
-    bm25 = BM25Okapi(tokenized_corpus)
-    
-    # Cache chỉ BM25 object (không cache chunks)
-    with open(BM25_INDEX_FILE, "wb") as f:
-        pickle.dump(bm25, f)
-    
-    print(f"✓ BM25 index built: {len(chunks)} chunks")
-    return bm25
-
-# Load chunks (luôn fresh từ Weaviate)
-print("📂 Loading chunks from Weaviate...")
-chunks_cache = load_chunks_from_weaviate()
-print(f"✓ Loaded {len(chunks_cache)} chunks")
-
-# Load or build BM25 index
-if BM25_INDEX_FILE.exists():
-    print("📂 Loading cached BM25 index...")
-    with open(BM25_INDEX_FILE, "rb") as f:
-        bm25_index = pickle.load(f)
-    print(f"✓ BM25 index loaded")
-else:
-    bm25_index = build_bm25_index(chunks_cache)
+def load_chunk_index() -> ChunkIndex:
+    return ChunkIndex(*get_bm25_and_chunks(), get_dense_index())
+
+_index = load_chunk_index()
+
+# Dense hit có uuid không nằm trong chunks_cache → cache cũ hơn Weaviate; reload ở đầu request kế tiếp
+_chunks_stale = False
+_refresh_lock = threading.Lock()
+
+def refresh_chunks():
+    """Fetch lại chunks + BM25 + dense index (chỉ khi đã đánh dấu stale), thay snapshot 1 lần"""
+    global _index, _chunks_stale
+    with _refresh_lock:
+        if not _chunks_stale:
+            return
+        logger.warning("🔄 Reloading chunk cache from Weaviate...")
+        invalidate_chunks()
+        _index = load_chunk_index()
+        _chunks_stale = False
+
+def current_index() -> ChunkIndex:
+    """Snapshot hiện tại (reload trước nếu đã đánh dấu stale) — mỗi request chỉ gọi 1 lần"""
+    if _chunks_stale:
+        refresh_chunks()
+    return _index
 
 # ---------------- RETRIEVAL FUNCTIONS ----------------
-def retrieve_bm25(query: str, k: int) -> Tuple[List[int], List[float]]:
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Chỉ số top-k theo score giảm dần: argpartition O(N), chỉ sort k phần tử"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+def retrieve_bm25(index: ChunkIndex, query: str, k: int) -> Tuple[List[int], List[float]]:
     """BM25 retrieval với pyvi"""
-    tokenized_query = ViTokenizer.tokenize(query).split()
-    scores = bm25_index.get_scores(tokenized_query)
-    top_indices = np.argsort(-scores)[:k]
-    top_scores = scores[top_indices]
-    return top_indices.tolist(), top_scores.tolist()
-
-def retrieve_dense(query: str, k: int) -> List[Dict]:
-    """Dense vector search từ Weaviate"""
-    q_vec = emb_model.encode([query], normalize_embeddings=True)[0]
+    tokenized_query = tokenize_query(query)  # lru_cache
+    k = min(k, index.bm25.scores["num_docs"])
+    # retrieve trả về top-k đã sort (token lạ bị bỏ qua)
+    top_indices, top_scores = index.bm25.retrieve([tokenized_query], k=k, show_progress=False)
+    return top_indices[0].tolist(), top_scores[0].tolist()
+
+def encode_cached(texts: List[str]) -> np.ndarray:
+    """emb_model.encode có cache: chỉ encode text chưa gặp, trả về ma trận float32 liền mạch"""
+    return query_emb_cache.encode(
+        texts,
+        lambda miss: emb_model.encode(miss, batch_size=32, normalize_embeddings=True, convert_to_numpy=True),
+    )
+
+def encode_query(query: str) -> np.ndarray:
+    """Query vector (normalized) — dùng chung cho dense search và semantic answer cache"""
+    return encode_cached([query])[0]
+
+def retrieve_dense(index: ChunkIndex, query: str, k: int,
+                   q_vec: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dense vector search: local index.dense (faiss/numpy) hoặc Weaviate near_vector
+    Returns: (rows int32 trong index.chunks, scores float32)
+    Hit không có trong chunks_cache (cache cũ) bị bỏ + log warning + đánh dấu reload
+    """
+    global _chunks_stale
+    if q_vec is None:
+        q_vec = encode_query(query)
     
+    if index.dense is not None:
+        # Local IndexFlatIP: vector đã normalize → inner product = 1 - cosine distance như Weaviate
+        D, I = index.dense.search(np.asarray(q_vec, dtype=np.float32).reshape(1, -1), k)
+        keep = I[0] >= 0
+        return I[0][keep].astype(np.int32), D[0][keep].astype(np.float32)
+    
+    # Chỉ lấy uuid + distance (display_citation cho nhẹ): props đầy đủ tra ở chunks_cache qua uuid_to_row
+    # → không kéo text/enriched_text của cả 20 candidates qua HTTP + JSON parse
     resp = weaviate_collection.query.near_vector(
         near_vector=q_vec.tolist(),
         limit=k,
         return_metadata=["distance"],
-        return_properties=[
-            "law", "chapter", "section", "article_no", "article_title",
-            "clause_no", "point", "clause_head", "text",
-            "enriched_text", "display_citation"
-        ]
+        return_properties=DENSE_PROPS
     )
     
-    results = []
+    rows = np.empty(len(resp.objects), dtype=np.int32)
+    scores = np.empty(len(resp.objects), dtype=np.float32)
+    n = 0
     for obj in resp.objects:
-        p = obj.properties
+        row = index.uuid_to_row.get(str(obj.uuid))
+        if row is None:
+            continue
+        rows[n] = row
         # Convert distance to similarity score (1 - distance)
-        score = 1.0 - obj.metadata.distance if obj.metadata.distance else 0.0
-        results.append({
-            "props": p,
-            "score": score
-        })
+        scores[n] = 1.0 - obj.metadata.distance if obj.metadata.distance else 0.0
+        n += 1
+    
+    if n < len(resp.objects):
+        # Không im lặng mất recall: báo và reload chunk cache trước request sau
+        _chunks_stale = True
+        logger.warning("⚠️  %d/%d dense hits not in chunks_cache (stale cache) → reload scheduled",
+                       len(resp.objects) - n, len(resp.objects))
     
-    return results
+    return rows[:n], scores[:n]
 
-def retrieve_hybrid(query: str, alpha: float, k: int) -> List[Dict]:
+def retrieve_hybrid(index: ChunkIndex, query: str, alpha: float, k: int, q_vec: Optional[np.ndarray] = None,
+                    bm25_future: Optional[Future] = None) -> Candidates:
     """
     Hybrid: alpha * dense + (1-alpha) * bm25
     alpha=0 → pure keyword, alpha=1 → pure vector
+    bm25_future: BM25 đã submit sẵn vào _executor (nếu None thì submit ở đây)
     """
-    # BM25 scores
-    bm25_indices, bm25_scores = retrieve_bm25(query, k)
-    bm25_scores_norm = np.array(bm25_scores) / (np.max(bm25_scores) + 1e-8)
+    # BM25 chạy nền trong lúc dense (encode + Weaviate) chạy ở thread hiện tại
+    if bm25_future is None:
+        bm25_future = _executor.submit(retrieve_bm25, index, query, k)
     
     # Dense scores
-    dense_results = retrieve_dense(query, k)
+    dense_rows, dense_scores = retrieve_dense(index, query, k, q_vec)
     
-    # Merge scores by chunk
-    # Create mapping: bm25 chunk → score
-    bm25_score_map = {}
-    for idx, score in zip(bm25_indices, bm25_scores_norm):
-        chunk = chunks_cache[idx]
-        key = chunk.get("display_citation", "")
-        bm25_score_map[key] = score
-    
-    # Combine
-    combined = []
-    for dense_res in dense_results:
-        citation = dense_res["props"].get("display_citation", "")
-        dense_score = dense_res["score"]
-        bm25_score = bm25_score_map.get(citation, 0.0)
-        
-        hybrid_score = alpha * dense_score + (1 - alpha) * bm25_score
-        combined.append({
-            "props": dense_res["props"],
-            "score": hybrid_score
-        })
+    # BM25 scores
+    bm25_indices, bm25_scores = bm25_future.result()
+    bm25_scores_norm = np.array(bm25_scores) / (np.max(bm25_scores) + 1e-8)
     
-    # Add BM25-only results (not in dense top-k)
-    dense_citations = {r["props"].get("display_citation", "") for r in dense_results}
-    for idx in bm25_indices:
-        chunk = chunks_cache[idx]
-        citation = chunk.get("display_citation", "")
-        if citation not in dense_citations:
-            bm25_score = bm25_score_map.get(citation, 0.0)
-            hybrid_score = (1 - alpha) * bm25_score
-            combined.append({
-                "props": chunk,
-                "score": hybrid_score
-            })
+    # Merge theo hàng của chunks_cache (uuid → row) thay cho dict theo citation:
+    # các leaf_window cùng display_citation không còn bị gộp nhầm điểm BM25
+    scores = np.zeros(len(index.chunks), dtype=np.float32)
+    picked = np.zeros(len(index.chunks), dtype=bool)
+    bm25_rows = np.asarray(bm25_indices, dtype=np.int64)
+    scores[bm25_rows] = (1 - alpha) * bm25_scores_norm
+    picked[bm25_rows] = True
+    scores[dense_rows] += alpha * dense_scores
+    picked[dense_rows] = True
     
     # Sort by hybrid score
-    combined.sort(key=lambda x: x["score"], reverse=True)
-    return combined[:k]
+    rows = np.flatnonzero(picked)
+    rows = rows[top_k_indices(scores[rows], k)]
+    return Candidates(rows.astype(np.int32), scores[rows], index)
+
+def candidate_citations(candidates: Candidates) -> Set[str]:
+    """Tập display_citation của candidates (answer cache dùng để validate semantic hit)"""
+    chunks = candidates.index.chunks
+    return {chunks[i].get("display_citation") or "" for i in candidates.idx}
 
-def rerank(query: str, candidates: List[Dict], final_k: int) -> List[Dict]:
-    """Rerank với CrossEncoder"""
-    if not candidates:
-        return []
+def rerank(index: ChunkIndex, query: str, cand_idx: np.ndarray, final_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rerank với CrossEncoder
+    Returns: (rows top final_k, cand_rerank của các rows đó)
+    """
+    if len(cand_idx) == 0:
+        return cand_idx, np.empty(0, dtype=np.float32)
     
     # Prepare texts
-    texts = [c["props"].get("enriched_text", "") for c in candidates]
-    pairs = [[query, text] for text in texts]
+    texts = [index.chunks[i].get("enriched_text", "") or "" for i in cand_idx]
     
-    # Rerank
-    scores = reranker.predict(pairs)
+    # Sorted batching: dài → ngắn (độ dài ký tự xấp xỉ số token), tokenizer pad "longest" trong từng batch
+    order = np.argsort([-len(t) for t in texts], kind="stable")
+    pairs = [[query, texts[i]] for i in order]
     
-    # Sort
-    for i, c in enumerate(candidates):
-        c["rerank_score"] = float(scores[i])
+    # Rerank rồi trả điểm về đúng vị trí candidate
+    cand_rerank = np.empty(len(texts), dtype=np.float32)
+    cand_rerank[order] = reranker.predict(pairs, batch_size=RERANK_BATCH, convert_to_numpy=True, show_progress_bar=False)
     
-    candidates.sort(key=lambda x: x["rerank_score"], reverse=True)
-    return candidates[:final_k]
+    # Top final_k
+    top = top_k_indices(cand_rerank, final_k)
+    return cand_idx[top], cand_rerank[top]
 
 # ---------------- MAIN RETRIEVE FUNCTION ----------------
-def retrieve(question: str, k: int = 5) -> Tuple[str, List[str]]:
+def retrieve_candidates(question: str, k: int = 5) -> Tuple[Candidates, np.ndarray]:
     """
-    Main retrieval function
-    Returns: (context_text, sources_list)
+    Hybrid candidates trước rerank + query vector
+    (answer cache dùng q_vec và tập citation của candidates để validate)
     """
-    # Ensure k is integer
     k = int(k) if k else 5
+    index = current_index()  # đọc snapshot 1 lần, truyền xuống các bước sau
     
     # Dynamic alpha tuning
     alpha = tune_alpha(question, base_alpha=0.55)
     
     # Hybrid search: lấy nhiều candidates để rerank có hiệu quả
     num_candidates = min(k * CANDIDATE_MULTIPLIER, 30)  # Max 30 candidates
-    candidates = retrieve_hybrid(question, alpha, num_candidates)
     
-    # Rerank về k chunks cuối cùng
-    top_results = rerank(question, candidates, k)
+    # Submit BM25 trước → encode query chạy song song với BM25
+    bm25_future = _executor.submit(retrieve_bm25, index, question, num_candidates)
+    q_vec = encode_query(question)
+    candidates = retrieve_hybrid(index, question, alpha, num_candidates, q_vec, bm25_future)
+    return candidates, q_vec
+
+def format_chunk(p: Dict) -> str:
+    """
+    1 chunk → text context cho LLM: các dòng tính sẵn rồi 1 lần "\n".join (bỏ dòng rỗng)
+    [Căn cứ] / Luật / Chương / Mục / Điều / Khoản / Điểm / nội dung
+    """
+    article_no = (p.get("article_no") or "").strip()
+    article_title = (p.get("article_title") or "").strip()
+    clause_no = (p.get("clause_no") or "")
+    clause_head = (p.get("clause_head") or "").strip()
+    point = (p.get("point") or "").strip()
+    display_citation = (p.get("display_citation") or "").strip()
+    
+    if article_no or article_title:
+        art_line = f"Điều {article_no}".strip() + (f". {article_title}" if article_title else "")
+    else:
+        art_line = ""
+    
+    # LEAF = ĐIỂM: cần cả clause_head + text điểm; LEAF = KHOẢN: chỉ label + text
+    if clause_no:
+        clause_line = f"Khoản {clause_no}. {clause_head}" if point and clause_head else f"Khoản {clause_no}"
+    else:
+        clause_line = ""
+    
+    lines = (
+        f"[Căn cứ: {display_citation}]" if display_citation else "",
+        (p.get("law") or "").strip(),
+        (p.get("chapter") or "").strip(),
+        (p.get("section") or "").strip(),
+        art_line,
+        clause_line,
+        f"Điểm {point})" if point else "",
+        (p.get("text") or "").strip(),
+    )
+    return "\n".join(filter(None, lines)).strip()
+
+def retrieve(question: str, k: int = 5, candidates: Optional[Candidates] = None) -> Tuple[str, List[str]]:
+    """
+    Main retrieval function
+    candidates: kết quả retrieve_candidates đã có sẵn (bỏ qua bước hybrid search);
+                rerank + format dùng đúng snapshot candidates.index
+    Returns: (context_text, sources_list)
+    """
+    # Ensure k is integer
+    k = int(k) if k else 5
+    
+    if candidates is None:
+        candidates, _ = retrieve_candidates(question, k)
+    index = candidates.index
+    
+    # Rerank về k chunks cuối cùng (trừ khi hybrid đã đủ chắc chắn)
+    rerank_stats["total"] += 1
+    cand_score = candidates.score
+    gap = float(cand_score[0] - cand_score[k]) if len(cand_score) > k else 0.0
+    if gap > RERANK_SKIP_GAP and LEGAL_HINT_RE.search(question):
+        rerank_stats["skipped"] += 1
+        logger.info("⏩ Skip rerank (gap %.2f, %d/%d)", gap, rerank_stats["skipped"], rerank_stats["total"])
+        top_rows = candidates.idx[:k]
+    else:
+        top_rows, _ = rerank(index, question, candidates.idx, k)
     
     # Format context for LLM (giống retriever.py)
     contexts = []
     sources = []
     
-    for res in top_results:
-        p = res["props"]
+    # Chỉ tới đây mới đọc dict props của chunk
+    for i in top_rows:
+        p = index.chunks[i]
         
-        law = (p.get("law") or "").strip()
-        chapter = (p.get("chapter") or "").strip()
-        section = (p.get("section") or "").strip()
-        article_no = (p.get("article_no") or "").strip()
-        article_title = (p.get("article_title") or "").strip()
-        clause_no = (p.get("clause_no") or "")
-        clause_head = (p.get("clause_head") or "").strip()
-        point = (p.get("point") or "").strip()
-        body_for_ctx = (p.get("text") or "").strip()
-        display_citation = (p.get("display_citation") or "").strip()
-        
-        lines = []
-        
-        # Add citation reference at the top
-        if display_citation:
-            lines.append(f"[Căn cứ: {display_citation}]")
-        
-        # Luật / Chương / Mục / Điều
-        if law:
-            lines.append(law)
-        if chapter:
-            lines.append(chapter)
-        if section:
-            lines.append(section)
-        if article_no or article_title:
-            art_line = f"Điều {article_no}".strip()
-            if article_title:
-                art_line += f". {article_title}"
-            lines.append(art_line)
-        
-        # Phân biệt: có Điểm hay không
-        if point:
-            # LEAF = ĐIỂM: cần cả clause_head + text điểm
-            if clause_no and clause_head:
-                lines.append(f"Khoản {clause_no}. {clause_head}")
-            elif clause_no:
-                lines.append(f"Khoản {clause_no}")
-            
-            lines.append(f"Điểm {point})")
-            
-            if body_for_ctx:
-                lines.append(body_for_ctx)
-        else:
-            # LEAF = KHOẢN: chỉ label + text
-            if clause_no:
-                lines.append(f"Khoản {clause_no}")
-            if body_for_ctx:
-                lines.append(body_for_ctx)
-        
-        ctx_chunk = "\n".join(lines).strip()
+        ctx_chunk = format_chunk(p)
         if ctx_chunk:
             contexts.append(ctx_chunk)
         
@@ -325,6 +349,8 @@ import atexit
 
 def cleanup():
     """Close Weaviate connection on exit"""
+    _executor.shutdown(wait=False)
+    query_emb_cache.close()
     try:
         if client:
             client.close()
@@ -332,6 +358,3 @@ def cleanup():
         pass
 
 atexit.register(cleanup)
-
-
-
@@ -0,0 +1,42 @@
+# vi_tokenizer.py
+# -*- coding: utf-8 -*-
+"""
+Tách từ tiếng Việt (pyvi) cho BM25
+- Query: lru_cache → câu hỏi lặp lại không gọi lại CRF của pyvi
+- Corpus: tokenize song song bằng ProcessPoolExecutor (pyvi giữ GIL gần như toàn bộ)
+  start method "forkserver" ("spawn" nếu không có, vd Windows): không fork tiến trình Streamlit
+  đang giữ thread torch/gRPC
+- Module nhẹ (chỉ import pyvi) → worker tokenize không kéo theo model embedding/reranker
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from pyvi import ViTokenizer
+
+
+@lru_cache(maxsize=4096)
+def _tok(s: str) -> Tuple[str, ...]:
+    return tuple(ViTokenizer.tokenize(s).split())
+
+
+def tokenize_query(query: str) -> List[str]:
+    return list(_tok(query))
+
+
+def tokenize_doc(text: str) -> List[str]:
+    return ViTokenizer.tokenize(text).split()
+
+
+def tokenize_corpus(texts: Sequence[str], workers: Optional[int] = None) -> List[List[str]]:
+    """Tokenize toàn bộ corpus, giữ thứ tự; workers=1 → chạy tuần tự"""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(texts) < 256:
+        return [tokenize_doc(t) for t in texts]
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    ctx = multiprocessing.get_context(method)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        return list(pool.map(tokenize_doc, texts, chunksize=max(1, len(texts) // (workers * 4))))
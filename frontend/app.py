@@ -11,10 +11,14 @@ if ROOT_DIR not in sys.path:
 
 import streamlit as st
 import time
+import logging
+
+# Log của backend (logger "rag"): LOG_LEVEL=INFO để xem timing từng bước
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
 # Giả định rằng bạn đã clone repo và các file này nằm trong thư mục 'backend'
 # (Nếu file của bạn tên khác, hãy sửa lại đường dẫn import)
-from backend.retriever_custom import retrieve
-from backend.generator import generate_answer
+# ask_law_stream = retrieve + generate_answer_stream, có answer cache (exact + semantic) phía trước
+from backend.rag_qa import ask_law_stream
 
 # Page config
 st.set_page_config(
@@ -33,74 +37,7 @@ st.markdown("""
 .chat-title { font-size: 1.8rem; font-weight: bold; margin: 0; }
 .chat-subtitle { font-size: 0.9rem; opacity: 0.9; margin-top: 0.3rem; }
 
-/* Tin nhắn user*/
-.user-message {
-    background-color: #e5e5ea;
-    color: #111;
-    padding: 0.6rem 1rem; /* giảm padding trên/dưới */
-    border-radius: 18px 18px 4px 18px;
-    margin: 0.5rem 0 0.5rem auto;
-    white-space: pre-line;
-    max-width: 80%;
-    width: fit-content;
-    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    word-wrap: break-word;
-    animation: fadeInUp 0.3s ease-out;
-    text-align: left;
-}
-
-
-/* --- ĐÃ SỬA TỪ ĐÂY --- */
-
-/* 1. Đây là KHUNG BAO NGOÀI MỚI cho toàn bộ phản hồi của Bot */
-.bot-response-container {
-    margin: 0.5rem auto 0.5rem 0; /* Căn lề trái */
-    max-width: 85%;              /* Giới hạn chiều rộng tối đa */
-    width: fit-content;          /* Tự co dãn theo nội dung */
-    animation: fadeInUp 0.3s ease-out; /* Áp dụng animation cho cả khối */
-}
-
-/* 2. Tin nhắn bot (Đã BỎ CÁC THUỘC TÍNH LAYOUT) */
-.bot-message {
-    background-color: #e5e5ea; /* xám nhạt */
-    color: #111;
-    padding: 1rem 1.2rem;
-    border-radius: 18px 18px 18px 4px;
-    box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-    word-wrap: break-word;
-    /* Đã BỎ: margin, max-width, width, animation */
-}
-
-/* 3. Chỉnh expander (Nguồn tham khảo) để nó khớp với style */
-.bot-response-container .stExpander {
-    border: none;
-    box-shadow: none;
-    margin-top: 0.5rem;
-    border-radius: 10px;
-    background-color: #f0f0f0; /* Một màu xám nhạt khác biệt */
-}
-.bot-response-container .stExpander header {
-    padding: 0.5rem 1rem;
-    font-size: 0.9rem;
-    border-radius: 10px;
-}
-
-/* --- KẾT THÚC PHẦN SỬA --- */
-
-
-/* Bot icon */
-.bot-icon {
-    display: inline-block;
-    background: #4f46e5;
-    color: white;
-    width: 32px;
-    height: 32px;
-    border-radius: 50%;
-    text-align: center;
-    line-height: 32px;
-    margin-right: 0.5rem;
-    font-weight: bold;
-}
+/* Tin nhắn user / bot: dùng st.chat_message (style mặc định của Streamlit) */
 
 /* Nguồn tham khảo */
 .source-item {
@@ -120,18 +57,12 @@ st.markdown("""
 .sample-question { background: #f8f9fa; padding: 0.8rem 1rem; border-radius: 10px; margin: 0.5rem 0; cursor: pointer; border: 1px solid #dee2e6; transition: all 0.3s; }
 .sample-question:hover { background: #e9ecef; border-color: #667eea; transform: translateY(-2px); }
 .metric-inline { display: inline-block; background: #f0f0f0; padding: 0.3rem 0.8rem; border-radius: 8px; margin: 0.2rem; font-size: 0.8rem; color: #666; }
-@keyframes fadeInUp {
-    from { opacity: 0; transform: translateY(20px); }
-    to { opacity: 1; transform: translateY(0); }
-}
 </style>
 """, unsafe_allow_html=True)
 
 # Initialize session state
 if 'messages' not in st.session_state:
     st.session_state.messages = []
-if 'running_rag' not in st.session_state:
-    st.session_state.running_rag = False
 if 'chat_started' not in st.session_state:
     st.session_state.chat_started = False
 
@@ -207,7 +138,6 @@ with st.sidebar:
     if st.button("🗑️ Xóa hội thoại", use_container_width=True):
         st.session_state.messages = []
         st.session_state.chat_started = False
-        st.session_state.running_rag = False
         st.rerun()
 
 # Biến tạm để lưu input
@@ -221,111 +151,95 @@ sample_questions = [
     "Xe máy chở 2 người trở lên có bị phạt không?",
 ]
 
+# placeholder: xóa khối câu hỏi mẫu ngay trong lượt chạy hiện tại khi đã có câu hỏi
+sample_box = st.empty()
 if len(st.session_state.messages) == 0:
-    st.markdown("""
-    <div style='text-align: center; margin: 2rem 0;'>
-        <h4 style='color: #666;'>💡 Bạn có thể bắt đầu với các câu hỏi này:</h4>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    col1, col2 = st.columns(2)
-    for idx, question in enumerate(sample_questions):
-        with col1 if idx % 2 == 0 else col2:
-            if st.button(f"💡 {question}", key=f"sample_{idx}", use_container_width=True):
-                user_input = question
+    with sample_box.container():
+        st.markdown("""
+        <div style='text-align: center; margin: 2rem 0;'>
+            <h4 style='color: #666;'>💡 Bạn có thể bắt đầu với các câu hỏi này:</h4>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        col1, col2 = st.columns(2)
+        for idx, question in enumerate(sample_questions):
+            with col1 if idx % 2 == 0 else col2:
+                if st.button(f"💡 {question}", key=f"sample_{idx}", use_container_width=True):
+                    user_input = question
 
 # Chat input
 chat_input = st.chat_input("Nhập câu hỏi của bạn...")
 if chat_input:
     user_input = chat_input.strip()
 
-# Display messages
-for idx, message in enumerate(st.session_state.messages):
-    if message["role"] == "user":
-        # Xử lý text: loại bỏ khoảng trắng thừa ở đầu/cuối mỗi dòng, loại bỏ dòng trống và escape HTML
-        user_text = message['content'].strip()
-        # Loại bỏ khoảng trắng thừa ở đầu/cuối mỗi dòng và bỏ dòng trống
-        user_text = '\n'.join(line.strip() for line in user_text.split('\n') if line.strip())
-        user_text = user_text.replace('<', '&lt;').replace('>', '&gt;')
-        # Chuyển newline thành <br> để hiển thị đúng
-        user_text = user_text.replace('\n', '<br>')
-        st.markdown(f'<div style="text-align: right;"><div class="user-message">{user_text}</div></div>', unsafe_allow_html=True)
-    else:
-        with st.container():
-            st.markdown('<div class="bot-response-container">', unsafe_allow_html=True)
-            
-            st.markdown(f"""
-                <div class="bot-message">
-                    <span class="bot-icon">⚖️</span>
-                    <strong>RoadLawQA</strong><br><br>
-                    {message['content']}
-                </div>
-            """, unsafe_allow_html=True)
-            
-            if 'sources' in message and message['sources']:
-                with st.expander("📚 Nguồn tham khảo", expanded=False):
-                    for i, src in enumerate(message['sources'], 1):
-                        if src:
-                            st.markdown(f'<div class="source-item">[{i}] {src}</div>', unsafe_allow_html=True)
-            
-            if 'metrics' in message:
-                m = message['metrics']
-                st.markdown(f"""
-                <div style='text-align: left; margin-top: 0.5rem;'>
-                    <span class="metric-inline">⏱️ {m['total']:.2f}s</span>
-                    <span class="metric-inline">🔍 {m['retrieval']:.2f}s</span>
-                    <span class="metric-inline">🤖 {m['generation']:.2f}s</span>
-                    <span class="metric-inline">📄 {m['chunks']} chunks</span>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            st.markdown('</div>', unsafe_allow_html=True)
-    
-    st.markdown("<br>", unsafe_allow_html=True)
-
-# Handle RAG logic
-if user_input and not st.session_state.running_rag:
-    st.session_state.running_rag = True 
+def render_extras(message):
+    """Nguồn tham khảo + metrics dưới câu trả lời của bot"""
+    if message.get('sources'):
+        with st.expander("📚 Nguồn tham khảo", expanded=False):
+            for i, src in enumerate(message['sources'], 1):
+                if src:
+                    st.markdown(f'<div class="source-item">[{i}] {src}</div>', unsafe_allow_html=True)
+    
+    if 'metrics' in message:
+        m = message['metrics']
+        st.markdown(f"""
+        <div style='text-align: left; margin-top: 0.5rem;'>
+            <span class="metric-inline">⏱️ {m['total']:.2f}s</span>
+            <span class="metric-inline">🔍 {m['retrieval']:.2f}s</span>
+            <span class="metric-inline">🤖 {m['generation']:.2f}s</span>
+            <span class="metric-inline">📄 {m['chunks']} chunks</span>
+            {f'<span class="metric-inline">⚡ cache ({m["cache"]})</span>' if m.get('cache') else ''}
+        </div>
+        """, unsafe_allow_html=True)
+
+# Display messages (st.chat_message: markdown thuần, không dựng lại khối HTML cho từng tin nhắn)
+for message in st.session_state.messages:
+    with st.chat_message(message["role"], avatar="⚖️" if message["role"] == "assistant" else None):
+        st.markdown(message["content"])
+        if message["role"] == "assistant":
+            render_extras(message)
+
+# Handle RAG logic: 1 lượt chạy duy nhất (không st.rerun) — render câu hỏi rồi stream câu trả lời tại chỗ
+if user_input:
+    sample_box.empty()
+    question = user_input.strip()
     st.session_state.messages.append({
         "role": "user",
-        "content": user_input.strip()
+        "content": question
     })
-    st.rerun()
-
-if st.session_state.messages and st.session_state.messages[-1]["role"] == "user" and st.session_state.running_rag:
-    last_user_question = st.session_state.messages[-1]["content"]
+    with st.chat_message("user"):
+        st.markdown(question)
     
-    with st.spinner("Đang suy nghĩ..."):
-        start_time = time.time()
-        
+    start_time = time.time()
+    with st.chat_message("assistant", avatar="⚖️"):
         try:
-            t0 = time.time()
-            context, sources = retrieve(last_user_question, k=k_value)
-            retrieval_time = time.time() - t0
-            
-            t1 = time.time()
-            answer, sources = generate_answer(last_user_question, context, sources)
-            generation_time = time.time() - t1
+            timings = {}
+            # Spinner chỉ bao retrieval; answer hiện dần theo từng chunk Gemini trả về
+            with st.spinner("Đang suy nghĩ..."):
+                stream, sources = ask_law_stream(question, k=k_value, metrics=timings)
+            answer = st.write_stream(stream)
             
             total_time = time.time() - start_time
             
-            st.session_state.messages.append({
+            message = {
                 "role": "assistant",
                 "content": answer,
                 "sources": sources,
                 "metrics": {
                     "total": total_time,
-                    "retrieval": retrieval_time,
-                    "generation": generation_time,
-                    "chunks": len(sources)
+                    "retrieval": timings["retrieval"],
+                    "generation": timings["generation"],
+                    "chunks": len(sources),
+                    "cache": timings["cache"],
                 }
-            })
+            }
+            render_extras(message)
             
         except Exception as e:
-            st.session_state.messages.append({
+            message = {
                 "role": "assistant",
                 "content": f"❌ Xin lỗi, đã xảy ra lỗi: {str(e)}"
-            })
+            }
+            st.markdown(message["content"])
     
-    st.session_state.running_rag = False
-    st.rerun()
\ No newline at end of file
+    st.session_state.messages.append(message)